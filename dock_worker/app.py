@@ -1,35 +1,113 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, RedirectResponse
 from pydantic import BaseModel
 from dock_worker.trigger import GitHubActionManager, ImageArgs
 from loguru import logger
-from dock_worker.schemas import TriggerRequest, JobQueryReq
+from dock_worker.schemas import TriggerRequest, JobInDB, AUTO_WORKFLOW_NAME, SKOPEO_WORKFLOW_NAME
 from dock_worker.core import config
-from dock_worker.core.db import Jobs, get_db
-from dock_worker.trigger import action_trigger
+from dock_worker.core.db import Jobs, get_db, init_db
+from dock_worker.trigger import get_action_trigger
+from dock_worker.tracker import JobTracker, cancel_superseded_jobs, wait_for_job
+from dock_worker.eta import with_eta
+from dock_worker.mirror import MirrorFailed, MirrorNotReady, PullThroughMirror, target_url
+from dock_worker.routing import supports_platform
 
-app = FastAPI(title="Docker Image Pusher API")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    # 单 worker 时 /trigger 已触发 workflow, 后台只轮询状态; 多 worker 时由持有租约的 worker 触发
+    tracker = JobTracker()
+    tracker.start()
+    yield
+    tracker.stop()
 
-@app.post("/trigger")
-async def trigger_workflow(request: TriggerRequest):
-    image_args = ImageArgs(source=request.source, target=request.target)
+
+app = FastAPI(title="Docker Image Pusher API", lifespan=lifespan)
+
+
+def create_job(request: TriggerRequest) -> Jobs:
+    image_args = ImageArgs(source=request.source, target=request.target, platform=request.platform)
 
     logger.info(f"Trigger request: {image_args=}, {request=}")
 
-    new_job_obj = action_trigger.fork_image(
-        image_args=image_args, test_mode=False
-    )
+    action_trigger = get_action_trigger()
+    workflow_name = request.workflow or config.default_workflow_name
+    route = None
+    if workflow_name == AUTO_WORKFLOW_NAME:
+        workflow, route = action_trigger.route_image(image_args)
+    else:
+        workflow = action_trigger.get_workflow_by_name(workflow_name)
+    if not workflow:
+        raise HTTPException(status_code=404, detail=f"Workflow `{workflow_name}` not found")
+    if image_args.platform and not supports_platform(workflow.name):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Workflow `{workflow.name}` does not support platform, use `{SKOPEO_WORKFLOW_NAME}` or `auto`",
+        )
+
+    if config.multi_worker:
+        # 仅记录任务, 由持有租约的 worker 触发 workflow
+        new_job_obj = action_trigger.build_job(image_args, workflow=workflow, route=route)
+        dispatched_at = None
+    else:
+        new_job_obj = action_trigger.fork_image(
+            image_args=image_args, test_mode=False, workflow=workflow, route=route
+        )
+        dispatched_at = datetime.now()
     if not new_job_obj:
         raise HTTPException(status_code=500, detail="Fork image failed")
 
     with get_db() as db:
-        new_job = Jobs(**new_job_obj.model_dump())
+        new_job = Jobs(**new_job_obj.model_dump(), dispatched_at=dispatched_at)
         db.add(new_job)
         db.commit()
         db.refresh(new_job)
     return new_job
 
 
+def supersede_jobs(job: Jobs):
+    """
+    取消同一 target 的旧任务, 已触发任务的 github run 由 JobTracker 取消
+    """
+    if config.cancel_superseded_runs:
+        cancel_superseded_jobs(job)
+
+
+@app.post("/trigger")
+async def trigger_workflow(request: TriggerRequest, background_tasks: BackgroundTasks):
+    # 自动选择 workflow 时需要读取源镜像清单, 与触发 workflow 一样是阻塞请求, 不在事件循环中执行
+    new_job = await asyncio.to_thread(create_job, request)
+    background_tasks.add_task(supersede_jobs, new_job)
+    return with_eta(JobInDB.model_validate(new_job))
+
+
+@app.get("/jobs")
+async def list_jobs(status: str | None = None, limit: int = 100):
+    """
+    最近的任务, 按 id 从新到旧
+    """
+    with get_db() as db:
+        query = db.query(Jobs)
+        if status:
+            query = query.filter(Jobs.status == status)
+        return [with_eta(JobInDB.model_validate(job)) for job in query.order_by(Jobs.id.desc()).limit(limit).all()]
+
+
+@app.get("/jobs/{distinct_id}")
+async def get_job(distinct_id: str):
+    with get_db() as db:
+        job = db.query(Jobs).filter(Jobs.distinct_id == distinct_id).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job_info = JobInDB.model_validate(job)
+    return with_eta(job_info)
+
+
 @app.get("/workflows")
 async def list_workflows():
     action_trigger = GitHubActionManager()
@@ -65,13 +143,64 @@ async def get_workflow_runs(
 
 
 @app.get("/workflow/runs/{distinct_id}")
-async def get_workflow_runs(distinct_id: str):
-    runs = action_trigger.wait_for_workflow_complete(
-        image_args=JobQueryReq(distinct_id=distinct_id),
-        test_mode=False,
-        using_db=True
+async def get_workflow_runs(distinct_id: str, timeout: float = 600):
+    job_info = await wait_for_job(distinct_id, timeout=timeout)
+    if not job_info:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_info
+
+
+def create_mirror_job(source: str, target: str) -> str | None:
+    """
+    在线程中调用, 可以直接取消旧任务
+    """
+    try:
+        new_job = create_job(TriggerRequest(source=source, target=target))
+    except HTTPException as e:
+        logger.error(f"Create mirror job for {source} failed: {e.detail}")
+        return None
+    supersede_jobs(new_job)
+    return new_job.distinct_id
+
+
+mirror = PullThroughMirror(create_job=create_mirror_job)
+REGISTRY_HEADERS = {"Docker-Distribution-API-Version": "registry/2.0"}
+
+
+def registry_error(status_code: int, code: str, message: str, headers: dict | None = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"errors": [{"code": code, "message": message}]},
+        headers={**REGISTRY_HEADERS, **(headers or {})},
     )
-    return runs
+
+
+@app.get("/v2/")
+async def registry_version_check():
+    return JSONResponse(content={}, headers=REGISTRY_HEADERS)
+
+
+@app.api_route("/v2/{name:path}/manifests/{reference}", methods=["GET", "HEAD"])
+async def registry_manifest(name: str, reference: str, request: Request):
+    """
+    镜像不在私有仓库中时先触发转存并等待, 之后重定向到私有仓库
+    """
+    logger.info(f"Registry {request.method} manifest: {name}:{reference}")
+    try:
+        await mirror.ensure_mirrored(name, reference)
+    except MirrorNotReady as e:
+        return registry_error(
+            503, "UNAVAILABLE", f"mirroring in progress, job: {e.distinct_id}",
+            headers={"Retry-After": str(int(config.poll_interval * 5))},
+        )
+    except MirrorFailed as e:
+        return registry_error(404, "MANIFEST_UNKNOWN", str(e))
+    return RedirectResponse(target_url(name, "manifests", reference), status_code=307, headers=REGISTRY_HEADERS)
+
+
+@app.api_route("/v2/{name:path}/blobs/{digest}", methods=["GET", "HEAD"])
+async def registry_blob(name: str, digest: str):
+    return RedirectResponse(target_url(name, "blobs", digest), status_code=307, headers=REGISTRY_HEADERS)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
 import argparse
+import sys
 
 from loguru import logger
 from rich.console import Console
 from rich.table import Table
 
+from dock_worker.schemas import AUTO_WORKFLOW_NAME, DOCKER_WORKFLOW_NAME, SKOPEO_WORKFLOW_NAME
+
 cli_desc = """
 Github Action Workflow Trigger.
 """
 
-DEFAULT_DW_WORKFLOW = "ApiDockerImagePusher"
-DEFAULT_DWS_WORKFLOW = "ApiSkopeoImageCopier"
+DEFAULT_DW_WORKFLOW = DOCKER_WORKFLOW_NAME
+DEFAULT_DWS_WORKFLOW = SKOPEO_WORKFLOW_NAME
+
+COMMANDS = ["fork", "pull", "prefetch", "seed", "serve"]
+# 不需要镜像名的命令
+STANDALONE_COMMANDS = ["prefetch", "serve"]
 
 
 def run_cli(default_workflow_name: str):
@@ -22,12 +29,16 @@ def run_cli(default_workflow_name: str):
     parser.add_argument(
         "--command", "-c", "--cmd",
         type=str,
-        choices=["fork", "pull"],
+        choices=COMMANDS,
         help="Command to execute",
         default="fork",
     )
     parser.add_argument(
-        "--workflow", type=str, help="workflow name to trigger", default=None
+        "--workflow", type=str, default=None,
+        help=f"workflow name to trigger, `{AUTO_WORKFLOW_NAME}` 根据镜像大小与架构自动选择",
+    )
+    parser.add_argument(
+        "--platform", type=str, default=None, help="只复制单个架构, 例如 linux/amd64, 仅 skopeo workflow 支持"
     )
     parser.add_argument(
         "--list-workflows", "-l", action="store_true", help="List all workflows"
@@ -35,17 +46,80 @@ def run_cli(default_workflow_name: str):
     parser.add_argument(
         "--test-mode", "-t", action="store_true", help="是否以测试模式运行"
     )
+    parser.add_argument(
+        "--pattern", "-p", type=str, action="append", default=None,
+        help="prefetch: 匹配任务 source/target 的通配符, 可多次指定",
+    )
+    parser.add_argument(
+        "--disk-budget", type=str, default=None, help="prefetch: 预拉取镜像的磁盘上限, 例如 20G"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=None, help="prefetch: 扫描已完成任务的间隔(秒)"
+    )
+    parser.add_argument(
+        "--api", type=str, default=None, help="prefetch: 查询已完成任务的 API 服务地址, 例如 http://10.0.0.1:8000"
+    )
+    parser.add_argument(
+        "--peer", type=str, action="append", default=None,
+        help="pull: 优先从局域网内这些主机获取镜像层, 例如 10.0.0.2:5050, 可多次指定",
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="pull: 拉取完成后在局域网内提供镜像层"
+    )
+    parser.add_argument(
+        "--port", type=int, default=None, help="seed/serve: 提供镜像层的端口"
+    )
+
+    # 支持 `dw prefetch` 形式的子命令写法
+    argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        argv = ["--command", argv[0], *argv[1:]]
 
     # Parse arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Show help if no arguments are provided
-    if not args.list_workflows and not args.source:
+    if not args.list_workflows and not args.source and args.command not in STANDALONE_COMMANDS:
         parser.print_help()
         return
 
     from dock_worker.trigger import ImageArgs, GitHubActionManager
     action_trigger = GitHubActionManager()
+
+    if args.command == "prefetch":
+        from dock_worker.prefetch import PrefetchDaemon
+        PrefetchDaemon(
+            action_trigger, patterns=args.pattern, disk_budget=args.disk_budget, interval=args.interval,
+            api_url=args.api,
+        ).run_forever()
+        return
+
+    if args.command in ["seed", "serve"]:
+        from dock_worker.distribute import LayerStore, seed_image, serve
+        store = LayerStore()
+        if args.command == "seed":
+            image_args = ImageArgs(source=args.source, target=args.target)
+            if not seed_image(action_trigger, image_args, store=store):
+                logger.error("Seed image failed")
+                return
+            action_trigger.tag_image(image_args.target, image_args.source)
+        serve(store, port=args.port)
+        return
+
+    from dock_worker.core import config
+    peers = args.peer or config.distribute_peers
+    if args.command == "pull" and (peers or args.serve):
+        # 局域网分发只拉取已转存的镜像, 不查询 workflow, 也不检查源镜像
+        from dock_worker.distribute import LayerStore, pull_with_peers, serve
+        image_args = ImageArgs(source=args.source, target=args.target)
+        store = LayerStore()
+        if not pull_with_peers(action_trigger, image_args, peers, store=store, serve=args.serve):
+            logger.error("Pull image failed")
+            return
+        if args.serve:
+            serve(store, port=args.port)
+        return
+
     # Get workflows
     workflows = action_trigger.workflows
     if not workflows:
@@ -56,26 +130,35 @@ def run_cli(default_workflow_name: str):
         show_workflows(workflows)
         return
 
+    # Create trigger args
+    image_args = ImageArgs(
+        source=args.source,
+        target=args.target,
+        platform=args.platform,
+    )
+
     selected_workflow_name = args.workflow or default_workflow_name
+    route = None
+    if selected_workflow_name == AUTO_WORKFLOW_NAME:
+        action_trigger.workflow, route = action_trigger.route_image(image_args)
+        selected_workflow_name = route.workflow_name
+    else:
+        action_trigger.workflow = action_trigger.get_workflow_by_name(selected_workflow_name)
     action_trigger.workflow_name = selected_workflow_name
-    action_trigger.workflow = next(
-        (wf for wf in workflows.workflows if wf.name == selected_workflow_name),
-        None,
-    )
     if not action_trigger.workflow:
         logger.error(f"Workflow `{selected_workflow_name}` not found.")
         show_workflows(workflows)
         return
+    from dock_worker.routing import supports_platform
+    if image_args.platform and not supports_platform(selected_workflow_name):
+        logger.error(f"Workflow `{selected_workflow_name}` does not support --platform, use dws or dwa instead.")
+        return
 
     if args.command in ["fork", "pull"]:
-        # Create trigger args
-        image_args = ImageArgs(
-            source=args.source,
-            target=args.target,
-        )
         logger.info(f"{image_args=}, {args=}")
         if args.command == "fork":
-            if not (job_info := action_trigger.fork_image(image_args=image_args, test_mode=args.test_mode)):
+            if not (job_info := action_trigger.fork_image(image_args=image_args, test_mode=args.test_mode,
+                                                          route=route)):
                 logger.error("Fork image failed")
                 return
             action_trigger.wait_for_workflow_complete(job_info)
@@ -92,6 +175,10 @@ def main_skopeo():
     run_cli(DEFAULT_DWS_WORKFLOW)
 
 
+def main_auto():
+    run_cli(AUTO_WORKFLOW_NAME)
+
+
 def show_workflows(workflows):
     console = Console()
     table = Table(title="GitHub Workflows")
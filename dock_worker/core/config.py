@@ -41,6 +41,37 @@ class Settings(BaseSettings):
 
     db_path: str = os.path.join(CONFIG_DIR, "dock_worker.sqlite")
 
+    # workflow 为 auto 时, 需要复制的镜像不超过该大小走 skopeo workflow, 否则走释放磁盘后的 docker workflow
+    auto_route_size_threshold: str = "10G"
+    insecure_registries: list[str] = []  # 使用 http 访问的镜像仓库, 例如 localhost:5000
+
+    # workflow 暂时性失败(限流, 超时)后自动重试
+    retry_max_attempts: int = 3  # 包括第一次运行
+    retry_backoff_base: float = 30  # 指数退避的初始等待(秒)
+    retry_backoff_max: float = 600
+    # 同一 target 有新的请求时, 取消仍在排队或运行中的旧 run
+    cancel_superseded_runs: bool = True
+
+    # pull-through 代理: 镜像尚未转存时, 清单请求最长等待的时间(秒), 超时后返回 503 由客户端重试
+    mirror_hold_timeout: float = 300
+
+    # 局域网分发: 本地按内容寻址的镜像层仓库, 对其他主机提供服务的端口, 以及默认的 peer 列表
+    distribute_store_dir: str = os.path.join(os.path.expanduser("~/.cache/dock_worker"), "store")
+    distribute_port: int = 5050
+    distribute_peers: list[str] = []
+
+    # 多 worker 部署, 开启后 /trigger 只记录任务, 由持有数据库租约的 worker 触发 workflow
+    # 无论是否开启, API 都在后台轮询任务状态并写回数据库
+    multi_worker: bool = False
+    lease_ttl: int = 30  # 租约有效期(秒), 持有者失联超过该时间后任务由其他 worker 接管
+    poll_interval: float = 2.0  # 后台轮询/等待数据库状态的间隔(秒)
+
+    # dw prefetch 预拉取
+    prefetch_patterns: list[str] = ["*"]  # 匹配任务 source/target 的通配符
+    prefetch_disk_budget: str = "20G"  # 预拉取镜像占用的本地磁盘上限, 超出后按最近使用时间淘汰
+    prefetch_interval: float = 30  # 扫描已完成任务的间隔(秒)
+    prefetch_api_url: str | None = None  # API 服务地址, 例如 http://10.0.0.1:8000, 为空时读取本地数据库
+
     class Config:
         env_file = CONFIG_PATH
 
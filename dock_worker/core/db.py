@@ -1,7 +1,7 @@
 from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime
-from sqlalchemy import create_engine
+from sqlalchemy import Column, String, Integer, DateTime, Float, UniqueConstraint
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from dock_worker.core import config
@@ -9,9 +9,18 @@ from dock_worker.core import config
 # Create SQLite database engine
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{config.db_path}"
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30}
 )
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL 模式允许多个 worker 进程同时读写同一个 sqlite 文件
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 
@@ -50,6 +59,77 @@ class Jobs(Base):
     workflow_id = Column(Integer, index=True)
     workflow_name = Column(String, index=True)
     full_url = Column(String, index=True)
+    platform = Column(String, nullable=True)
+    image_size = Column(Integer, nullable=True, comment="需要复制的压缩层大小(字节)")
+    platform_count = Column(Integer, nullable=True)
+    route_reason = Column(String, nullable=True, comment="自动选择 workflow 的依据")
+    attempt = Column(Integer, default=1, comment="当前是第几次运行, 重试后递增")
+    conclusion = Column(String, nullable=True, comment="github run conclusion")
+    next_retry_at = Column(DateTime, nullable=True, comment="等待重试的时间, 为空表示没有待执行的重试")
+    finished_at = Column(DateTime, nullable=True, comment="成功完成的时间")
+    dispatched_at = Column(DateTime, nullable=True, comment="workflow 触发时间, 为空表示尚未触发")
+    lease_owner = Column(String, nullable=True, index=True, comment="当前持有该任务租约的 worker")
+    lease_expires_at = Column(DateTime, nullable=True, comment="租约过期时间, 过期后可被其他 worker 接管")
+    cancel_requested_at = Column(DateTime, nullable=True, comment="被新任务取代的时间, 由持有租约的 worker 取消 run")
+
+
+class CachedImages(Base):
+    """
+    prefetch 预拉取到本地的镜像, 用于按最近使用时间淘汰
+    """
+    __tablename__ = "cached_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, index=True)
+    full_name = Column(String, unique=True, index=True, comment="镜像仓库中的完整镜像名")
+    local_name = Column(String, index=True, comment="重新打标签后的原始镜像名")
+    size = Column(Integer, default=0, comment="本地镜像大小(字节)")
+    pulled_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+    evicted_at = Column(DateTime, nullable=True, comment="淘汰时间, 保留记录避免再次预拉取")
+
+
+class JobDurationStats(Base):
+    """
+    按 workflow, 源镜像仓库与镜像大小分组的历史耗时汇总, 任务完成时增量更新, 用于估算 ETA
+    """
+    __tablename__ = "job_duration_stats"
+    __table_args__ = (UniqueConstraint("workflow_name", "source_repo", "size_bucket"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    workflow_name = Column(String, index=True)
+    source_repo = Column(String, index=True)
+    size_bucket = Column(Integer, index=True, comment="log2(镜像大小MB), -1 表示大小未知")
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0, comment="平均耗时(秒)")
+    m2 = Column(Float, default=0, comment="与平均值之差的平方和, 用于计算方差")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# 新增列在已有数据上的初始值. 旧版本在请求时就已触发 workflow, 补齐触发时间, 避免后台跟踪时重复触发
+_COLUMN_BACKFILL = {
+    ("jobs", "dispatched_at"): "COALESCE(created_at, updated_at)",
+    ("jobs", "attempt"): "1",
+}
+
+
+def _add_missing_columns():
+    """
+    create_all 不会修改已存在的表, 这里为旧数据库补齐新增的列
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                if backfill := _COLUMN_BACKFILL.get((table.name, column.name)):
+                    conn.execute(text(f"UPDATE {table.name} SET {column.name} = {backfill}"))
 
 
 def init_db():
@@ -57,6 +137,7 @@ def init_db():
     Initialize database
     """
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
 
 
 if __name__ == "__main__":
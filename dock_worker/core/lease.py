@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+
+from dock_worker.core import config
+from dock_worker.core.db import Jobs, get_db
+
+
+def worker_id() -> str:
+    """
+    当前进程的唯一标识, 作为租约持有者写入数据库.
+    每次调用时读取 pid, gunicorn --preload 在 fork 前导入模块时各 worker 也不会共用同一个标识
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_available_clause(owner: str, now: datetime):
+    """
+    租约可被 owner 获取的条件: 无人持有 / 自己持有(续约) / 已过期
+    """
+    return or_(
+        Jobs.lease_owner.is_(None),
+        Jobs.lease_owner == owner,
+        Jobs.lease_expires_at < now,
+    )
+
+
+def claim_job_lease(job_id: int, owner: str | None = None, ttl: int | None = None) -> bool:
+    """
+    尝试获取(或续约)任务租约, 单条 UPDATE 语句保证多个 worker 之间只有一个能成功
+    :return: 是否持有租约
+    """
+    owner = owner or worker_id()
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl or config.lease_ttl)
+    with get_db() as session:
+        result = session.execute(
+            update(Jobs)
+            .where(Jobs.id == job_id)
+            .where(lease_available_clause(owner, now))
+            .values(lease_owner=owner, lease_expires_at=expires_at)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def hold_job_lease(session, job_id: int, owner: str, ttl: int | None = None) -> bool:
+    """
+    在 session 当前的事务中确认租约仍由 owner 持有并续约, 不提交.
+    与任务状态的修改在同一事务中提交, 租约已被其他 worker 接管时调用方应回滚
+    """
+    result = session.execute(
+        update(Jobs)
+        .where(Jobs.id == job_id)
+        .where(Jobs.lease_owner == owner)
+        .values(lease_expires_at=datetime.now() + timedelta(seconds=ttl or config.lease_ttl))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_job_lease(job_id: int, owner: str | None = None) -> bool:
+    owner = owner or worker_id()
+    with get_db() as session:
+        result = session.execute(
+            update(Jobs)
+            .where(Jobs.id == job_id)
+            .where(Jobs.lease_owner == owner)
+            .values(lease_owner=None, lease_expires_at=None)
+        )
+        session.commit()
+        return result.rowcount == 1
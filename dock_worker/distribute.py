@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+局域网内分发镜像
+
+一台主机通过 pull_image 从镜像仓库拉取后, 用 docker save 导出, 把配置与镜像层压缩后存入按内容寻址的本地仓库,
+并通过 HTTP 在局域网内提供. 其他主机 `dw pull --peers ...` 优先从这些主机获取缺少的层, 失败时再从镜像仓库拉取,
+只有第一台主机占用出口带宽.
+
+本地仓库结构:
+    blobs/sha256/<hex>.gz   内容的 sha256 为 <hex>, 以 gzip 压缩存储
+    images/<name>.json      镜像索引: 配置, 镜像层与 tag
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import requests
+from loguru import logger
+from pydantic import BaseModel
+
+from dock_worker.core import config
+from dock_worker.utils import get_local_image_size
+
+COMPRESS_LEVEL = 3  # 局域网带宽充足, 压缩速度优先
+CHUNK_SIZE = 1024 * 1024
+
+
+class ImageIndex(BaseModel):
+    name: str
+    config: str  # sha256:<hex>
+    layers: list[str]
+    repo_tags: list[str] = []
+
+    @property
+    def digests(self) -> list[str]:
+        return [self.config, *self.layers]
+
+
+class LayerStore:
+
+    def __init__(self, root: str | None = None):
+        self.root = os.path.expanduser(root or config.distribute_store_dir)
+        os.makedirs(os.path.join(self.root, "blobs", "sha256"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "images"), exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        algorithm, _, hex_digest = digest.partition(":")
+        if algorithm != "sha256" or not hex_digest.isalnum():
+            raise ValueError(f"Invalid digest: {digest}")
+        return os.path.join(self.root, "blobs", "sha256", f"{hex_digest}.gz")
+
+    def index_path(self, name: str) -> str:
+        return os.path.join(self.root, "images", f"{quote(name, safe='')}.json")
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def put_blob(self, fileobj) -> str:
+        """
+        压缩写入本地仓库
+        :return: 内容的 digest
+        """
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode="wb", compresslevel=COMPRESS_LEVEL, mtime=0) as gz:
+                while chunk := fileobj.read(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    gz.write(chunk)
+        digest = f"sha256:{sha256.hexdigest()}"
+        os.replace(tmp.name, self.blob_path(digest))
+        return digest
+
+    def put_compressed_blob(self, digest: str, fileobj) -> bool:
+        """
+        写入从其他主机下载的压缩内容, 解压校验 digest 后才放入仓库
+        """
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as tmp:
+            shutil.copyfileobj(fileobj, tmp, CHUNK_SIZE)
+        try:
+            with gzip.open(tmp.name, "rb") as gz:
+                while chunk := gz.read(CHUNK_SIZE):
+                    sha256.update(chunk)
+        except (OSError, EOFError) as e:
+            logger.warning(f"Blob {digest} is corrupted: {e}")
+            os.remove(tmp.name)
+            return False
+        if f"sha256:{sha256.hexdigest()}" != digest:
+            logger.warning(f"Blob digest mismatch: {digest}")
+            os.remove(tmp.name)
+            return False
+        os.replace(tmp.name, self.blob_path(digest))
+        return True
+
+    def save_index(self, index: ImageIndex):
+        with open(self.index_path(index.name), "w", encoding="utf-8") as f:
+            f.write(index.model_dump_json())
+
+    def load_index(self, name: str) -> ImageIndex | None:
+        path = self.index_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return ImageIndex.model_validate_json(f.read())
+
+    def import_archive(self, archive_path: str, name: str) -> ImageIndex:
+        """
+        导入 docker save 生成的归档, 新旧两种格式都带有 manifest.json
+        """
+        with tarfile.open(archive_path) as tar:
+            manifest = json.load(tar.extractfile("manifest.json"))[0]
+
+            def put_member(member_name: str) -> str:
+                return self.put_blob(tar.extractfile(member_name))
+
+            index = ImageIndex(
+                name=name,
+                config=put_member(manifest["Config"]),
+                layers=[put_member(layer) for layer in manifest["Layers"]],
+                repo_tags=manifest.get("RepoTags") or [],
+            )
+        self.save_index(index)
+        return index
+
+    def export_archive(self, index: ImageIndex, archive_path: str):
+        """
+        按索引组装 docker load 可以读取的归档
+        """
+
+        def blob_name(digest: str) -> str:
+            return f"blobs/sha256/{digest.partition(':')[2]}"
+
+        manifest = [{
+            "Config": blob_name(index.config),
+            "RepoTags": index.repo_tags,
+            "Layers": [blob_name(layer) for layer in index.layers],
+        }]
+        with tarfile.open(archive_path, "w") as tar:
+            for digest in dict.fromkeys(index.digests):
+                with gzip.open(self.blob_path(digest), "rb") as gz:
+                    # 先解压到临时文件以得到大小, tarfile 需要预先知道成员大小
+                    with tempfile.TemporaryFile(dir=self.root) as tmp:
+                        shutil.copyfileobj(gz, tmp, CHUNK_SIZE)
+                        info = tarfile.TarInfo(blob_name(digest))
+                        info.size = tmp.tell()
+                        tmp.seek(0)
+                        tar.addfile(info, tmp)
+            body = json.dumps(manifest).encode()
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+
+
+def export_image(image_name: str, store: LayerStore) -> ImageIndex | None:
+    """
+    docker save 导出本地镜像并存入本地仓库
+    """
+    with tempfile.TemporaryDirectory(dir=store.root) as tmp_dir:
+        archive_path = os.path.join(tmp_dir, "image.tar")
+        logger.info(f"Exporting {image_name}")
+        result = subprocess.run(["docker", "save", "-o", archive_path, image_name])
+        if result.returncode != 0:
+            logger.error(f"docker save {image_name} failed")
+            return None
+        return store.import_archive(archive_path, image_name)
+
+
+def load_image(index: ImageIndex, store: LayerStore) -> bool:
+    with tempfile.TemporaryDirectory(dir=store.root) as tmp_dir:
+        archive_path = os.path.join(tmp_dir, "image.tar")
+        store.export_archive(index, archive_path)
+        result = subprocess.run(["docker", "load", "-i", archive_path])
+        return result.returncode == 0
+
+
+def make_handler(store: LayerStore):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+        def _respond(self, send_body: bool):
+            kind, _, key = self.path.lstrip("/").partition("/")
+            try:
+                if kind == "images" and (index := store.load_index(unquote(key))):
+                    body = index.model_dump_json().encode()
+                    return self._send(200, "application/json", len(body), send_body, body=body)
+                if kind == "blobs" and store.has_blob(key):
+                    path = store.blob_path(key)
+                    return self._send(200, "application/gzip", os.path.getsize(path), send_body, path=path)
+            except ValueError:
+                pass
+            self._send(404, "text/plain", 0, send_body)
+
+        def _send(self, status, content_type, length, send_body, body=None, path=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            if not send_body:
+                return
+            if body:
+                self.wfile.write(body)
+            elif path:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+        def do_GET(self):
+            self._respond(send_body=True)
+
+        def do_HEAD(self):
+            self._respond(send_body=False)
+
+    return Handler
+
+
+def make_server(store: LayerStore, host: str = "0.0.0.0", port: int | None = None) -> ThreadingHTTPServer:
+    port = config.distribute_port if port is None else port
+    return ThreadingHTTPServer((host, port), make_handler(store))
+
+
+def serve(store: LayerStore, host: str = "0.0.0.0", port: int | None = None):
+    server = make_server(store, host, port)
+    logger.info(f"Serving image layers from {store.root} on {host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def peer_url(peer: str) -> str:
+    return peer.rstrip("/") if peer.startswith(("http://", "https://")) else f"http://{peer}"
+
+
+def fetch_from_peers(name: str, peers: list[str], store: LayerStore, timeout: float = 30) -> ImageIndex | None:
+    """
+    从其他主机获取镜像索引与本地缺少的层, 任意一层获取失败都返回 None
+    """
+    index = None
+    for peer in peers:
+        try:
+            response = requests.get(f"{peer_url(peer)}/images/{quote(name, safe='')}", timeout=timeout)
+        except requests.RequestException as e:
+            logger.debug(f"Peer {peer} unavailable: {e}")
+            continue
+        if response.status_code == 200:
+            index = ImageIndex.model_validate(response.json())
+            break
+    if not index:
+        logger.info(f"{name} not found on peers")
+        return None
+
+    for digest in dict.fromkeys(index.digests):
+        if store.has_blob(digest):
+            continue
+        # 打乱顺序, 让各主机的下载分散到不同的 peer
+        for peer in random.sample(peers, len(peers)):
+            try:
+                with requests.get(f"{peer_url(peer)}/blobs/{digest}", stream=True, timeout=timeout) as response:
+                    if response.status_code == 200 and store.put_compressed_blob(digest, response.raw):
+                        logger.debug(f"Fetched {digest} from {peer}")
+                        break
+            except requests.RequestException as e:
+                logger.debug(f"Fetch {digest} from {peer} failed: {e}")
+        else:
+            logger.warning(f"Blob {digest} not available on any peer")
+            return None
+    store.save_index(index)
+    return index
+
+
+def pull_with_peers(manager, image_args, peers: list[str], store: LayerStore | None = None,
+                    serve: bool = False) -> bool:
+    """
+    优先从局域网内的其他主机获取镜像, 失败时回退到从镜像仓库拉取, 不会触发转存
+    :param serve: 之后是否作为 peer 提供镜像层, 从镜像仓库拉取时需要导出到本地仓库
+    """
+    store = store or LayerStore()
+    full_name = manager.make_image_full_name(image_args.target)
+    if peers and (index := fetch_from_peers(full_name, peers, store)) and load_image(index, store):
+        logger.success(f"Loaded {full_name} from peers")
+        return manager.tag_image(image_args.target, image_args.source)
+    logger.info(f"Fallback to registry: {full_name}")
+    # pull_image 不检查命令的退出码, 以本地是否存在镜像为准
+    if not manager.pull_image(image_args.target) or get_local_image_size(full_name) is None:
+        logger.error(f"Pull {full_name} from registry failed")
+        return False
+    if not manager.tag_image(image_args.target, image_args.source):
+        return False
+    return not serve or export_image(full_name, store) is not None
+
+
+def seed_image(manager, image_args, store: LayerStore | None = None) -> ImageIndex | None:
+    """
+    从镜像仓库拉取并导出到本地仓库, 作为局域网内的第一个来源
+    """
+    store = store or LayerStore()
+    if not manager.pull_image(image_args.target):
+        return None
+    full_name = manager.make_image_full_name(image_args.target)
+    return export_image(full_name, store)
+
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+根据历史任务耗时估算 ETA
+
+任务成功完成时, 把耗时累加到 (workflow, 源镜像仓库, 镜像大小档位) 对应的汇总行中(Welford 算法, 单条 UPDATE 完成),
+估算时只读取少量汇总行, 不扫描 Jobs 表. 精确分组没有历史数据时, 依次放宽到同仓库, 同大小档位, 同 workflow.
+"""
+import math
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from dock_worker.core.db import JobDurationStats, get_db
+from dock_worker.registry import parse_image_reference
+from dock_worker.schemas import JobInDB, JobStatusEnum
+
+UNKNOWN_SIZE_BUCKET = -1
+
+
+def source_repo(source: str) -> str:
+    """
+    >>> source_repo('ubuntu:20.04')
+    'registry-1.docker.io/library/ubuntu'
+    """
+    ref = parse_image_reference(source)
+    return f"{ref.registry}/{ref.repository}"
+
+
+def size_bucket(image_size: int | None) -> int:
+    """
+    按 log2(MB) 分档, 相邻档位的镜像大小相差一倍
+
+    >>> size_bucket(None)
+    -1
+    >>> size_bucket(300 * 1024 ** 2)
+    8
+    """
+    if not image_size:
+        return UNKNOWN_SIZE_BUCKET
+    return int(math.log2(max(image_size / 1024 ** 2, 1)))
+
+
+def record_duration(workflow_name: str, source: str, image_size: int | None, seconds: float):
+    """
+    把一次成功任务的耗时计入汇总, 均值与方差在 SQL 中按旧值原子更新, 多个 worker 同时写入也不会丢失
+    """
+    key = dict(workflow_name=workflow_name, source_repo=source_repo(source), size_bucket=size_bucket(image_size))
+    stats = JobDurationStats
+    new_mean = stats.mean + (seconds - stats.mean) / (stats.count + 1)
+    statement = (
+        update(stats)
+        .where(*[getattr(stats, k) == v for k, v in key.items()])
+        .values(count=stats.count + 1, mean=new_mean, m2=stats.m2 + (seconds - stats.mean) * (seconds - new_mean))
+    )
+    with get_db() as session:
+        if session.execute(statement).rowcount == 0:
+            session.add(JobDurationStats(**key, count=1, mean=seconds, m2=0))
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # 其他 worker 已插入同一分组
+                session.rollback()
+                session.execute(statement)
+        session.commit()
+    logger.debug(f"Recorded duration {seconds:.0f}s for {key}")
+
+
+def estimate_duration(workflow_name: str, source: str, image_size: int | None) -> float | None:
+    """
+    :return: 预计总耗时(秒), 没有任何可参考的历史数据时返回 None
+    """
+    stats = duration_stats(workflow_name, source, image_size)
+    return stats[0] if stats else None
+
+
+def duration_stats(workflow_name: str, source: str, image_size: int | None) -> tuple[float, float | None] | None:
+    """
+    :return: 历史耗时的均值与样本标准差(秒), 样本少于 2 个时标准差为 None,
+        没有任何可参考的历史数据时返回 None
+    """
+    repo, bucket = source_repo(source), size_bucket(image_size)
+    stats = JobDurationStats
+    candidates = [
+        [stats.source_repo == repo, stats.size_bucket == bucket],
+        [stats.source_repo == repo],
+        [stats.size_bucket == bucket],
+        [],
+    ]
+    with get_db() as session:
+        for conditions in candidates:
+            count, total, m2, square_sum = (
+                session.query(
+                    func.sum(stats.count), func.sum(stats.mean * stats.count),
+                    func.sum(stats.m2), func.sum(stats.count * stats.mean * stats.mean),
+                )
+                .filter(stats.workflow_name == workflow_name, *conditions)
+                .one()
+            )
+            if count:
+                mean = total / count
+                # 合并多个分组: 组内平方和加上各组均值相对总体均值的偏差
+                pooled_m2 = max(m2 + square_sum - count * mean ** 2, 0)
+                return mean, math.sqrt(pooled_m2 / (count - 1)) if count > 1 else None
+    return None
+
+
+def run_finished_at(run_info: dict) -> datetime:
+    """
+    run 完成的本地时间, 轮询发现完成的延迟(以及迁移前旧任务的等待)不计入耗时
+    """
+    if updated_at := run_info.get("updated_at"):
+        return datetime.fromisoformat(updated_at.replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
+    return datetime.now()
+
+
+def job_duration(job) -> float | None:
+    start = job.dispatched_at or job.created_at
+    if not start or not job.finished_at:
+        return None
+    # 完成时间来自 github, 与本机时钟略有偏差时不记为负数
+    return max((job.finished_at - start).total_seconds(), 0)
+
+
+def with_eta(job_info: JobInDB, now: datetime | None = None) -> JobInDB:
+    """
+    填充预计总耗时, 耗时标准差与剩余时间, 运行时间超过预计值时剩余时间为 0
+    """
+    if job_info.workflow_name and (
+            stats := duration_stats(job_info.workflow_name, job_info.source, job_info.image_size)
+    ):
+        job_info.expected_duration, job_info.duration_stddev = stats
+    if job_info.status in (JobStatusEnum.completed, JobStatusEnum.failed, JobStatusEnum.cancelled):
+        job_info.eta_seconds = 0
+    elif job_info.expected_duration is not None:
+        elapsed = ((now or datetime.now()) - (job_info.dispatched_at or job_info.created_at)).total_seconds()
+        job_info.eta_seconds = max(job_info.expected_duration - elapsed, 0)
+    return job_info
+
+
+def format_duration(seconds: float) -> str:
+    """
+    >>> format_duration(200)
+    '3m20s'
+    >>> format_duration(45)
+    '45s'
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+pull-through 镜像代理
+
+主机直接 `docker pull ourhost/library/ubuntu:20.04`, 服务检查镜像是否已在私有仓库命名空间中,
+不存在时触发转存并等待完成, 之后把清单与镜像层请求重定向到私有仓库.
+转存任务的状态由 API 后台的 JobTracker 写入数据库, 任务结束但镜像仍不存在时视为转存失败.
+私有仓库中的镜像名保留源镜像的命名空间, 只有私有仓库中存在该 tag 且有对应的已完成任务时才视为已转存,
+避免 foo/app 与 bar/app 等同名镜像互相覆盖.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from dock_worker.core import config
+from dock_worker.core.db import Jobs, get_db
+from dock_worker.registry import RegistryClient, registry_base_url
+from dock_worker.schemas import JobStatusEnum
+from dock_worker.tracker import ACTIVE_STATUSES, TERMINAL_STATUSES
+from dock_worker.utils import normalize_image_name
+
+# 超过该时间仍未完成的任务不再复用, 重新触发转存
+MIRROR_JOB_TTL = timedelta(hours=1)
+
+
+class MirrorNotReady(Exception):
+    """
+    等待超时, 转存仍在进行中
+    """
+
+    def __init__(self, distinct_id: str | None):
+        self.distinct_id = distinct_id
+        super().__init__(f"Mirroring in progress, job: {distinct_id}")
+
+
+class MirrorFailed(Exception):
+    """
+    转存任务失败
+    """
+
+
+def mirror_source(name: str, reference: str) -> str:
+    """
+    >>> mirror_source('library/ubuntu', '20.04')
+    'library/ubuntu:20.04'
+    >>> mirror_source('library/ubuntu', 'sha256:abc')
+    'library/ubuntu@sha256:abc'
+    """
+    separator = "@" if reference.startswith("sha256:") else ":"
+    return f"{name}{separator}{reference}"
+
+
+def target_repository(name: str) -> str:
+    """
+    私有仓库中的镜像仓库名, 保留命名空间, 转存时作为任务的 target
+
+    >>> target_repository('library/ubuntu')
+    'library_ubuntu'
+    """
+    return normalize_image_name(name, remove_namespace=False, replace_char="_")
+
+
+def target_url(name: str, kind: str, reference: str) -> str:
+    """
+    :param kind: manifests 或 blobs
+    """
+    base_url = registry_base_url(config.image_repositories_endpoint)
+    return f"{base_url}/v2/{config.name_space}/{target_repository(name)}/{kind}/{reference}"
+
+
+def find_active_job(source: str) -> Jobs | None:
+    with get_db() as session:
+        return (
+            session.query(Jobs)
+            .filter(Jobs.source == source)
+            .filter(Jobs.status.in_(ACTIVE_STATUSES))
+            .filter(Jobs.created_at > datetime.now() - MIRROR_JOB_TTL)
+            .order_by(Jobs.id.desc())
+            .first()
+        )
+
+
+def has_completed_job(source: str) -> bool:
+    with get_db() as session:
+        return session.query(Jobs.id).filter(Jobs.source == source).filter(
+            Jobs.status == JobStatusEnum.completed
+        ).first() is not None
+
+
+def get_job_status(distinct_id: str) -> str | None:
+    with get_db() as session:
+        job = session.query(Jobs).filter(Jobs.distinct_id == distinct_id).first()
+        return job.status if job else None
+
+
+class PullThroughMirror:
+
+    def __init__(self, create_job):
+        """
+        :param create_job: 触发转存并记录任务的函数, 参数为 source 与 target, 返回任务的 distinct_id, 失败时返回 None
+        """
+        self.create_job = create_job
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @property
+    def client(self) -> RegistryClient:
+        return RegistryClient(config.image_repositories_endpoint)
+
+    def is_mirrored(self, name: str, reference: str) -> bool:
+        if not has_completed_job(mirror_source(name, reference)):
+            return False
+        repository = f"{config.name_space}/{target_repository(name)}"
+        return self.client.manifest_exists(repository, reference)
+
+    async def ensure_mirrored(self, name: str, reference: str, timeout: float | None = None):
+        """
+        确保镜像已在私有仓库中, 不存在时触发转存并等待
+        :raise MirrorNotReady: 等待超时
+        :raise MirrorFailed: 触发失败或转存任务失败
+        """
+        if reference.startswith("sha256:") or await asyncio.to_thread(self.is_mirrored, name, reference):
+            # 按 digest 拉取的清单与镜像层来自已经转存过的 tag
+            return
+
+        source = mirror_source(name, reference)
+        target = f"{target_repository(name)}:{reference}"
+        # 同一个镜像的并发请求只触发一次转存
+        async with self._locks.setdefault(source, asyncio.Lock()):
+            if job := await asyncio.to_thread(find_active_job, source):
+                distinct_id = job.distinct_id
+            elif not (distinct_id := await asyncio.to_thread(self.create_job, source, target)):
+                raise MirrorFailed(f"Trigger mirroring {source} failed")
+            logger.info(f"Waiting for {source} to be mirrored, job: {distinct_id}")
+
+        deadline = time.monotonic() + (timeout if timeout is not None else config.mirror_hold_timeout)
+        while True:
+            # 先读状态再检查镜像, 避免任务恰好在两次查询之间完成时被误判为失败
+            status = await asyncio.to_thread(get_job_status, distinct_id)
+            if await asyncio.to_thread(self.is_mirrored, name, reference):
+                return
+            if status in TERMINAL_STATUSES:
+                raise MirrorFailed(f"Mirroring {source} {status}, job: {distinct_id}")
+            if time.monotonic() >= deadline:
+                raise MirrorNotReady(distinct_id)
+            await asyncio.sleep(config.poll_interval)
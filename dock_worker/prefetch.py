@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+dw prefetch: 在部署真正需要镜像之前, 提前拉取已完成转存的镜像
+
+定期查询已完成且匹配配置的任务, 通过 pull_image/tag_image 拉取并恢复原始镜像名,
+拉取前按任务记录的镜像大小检查磁盘预算, 超出预算时停止拉取; 实际大小超过预算时淘汰最久未使用的镜像.
+被淘汰的镜像保留记录, 不会再次预拉取.
+
+任务状态由 API 服务在后台轮询写入, 部署主机通过 API 的 /jobs 接口查询;
+未配置 API 地址时读取本地数据库, 只适用于与 API 服务运行在同一台主机上.
+"""
+import time
+from datetime import datetime
+from fnmatch import fnmatch
+
+import requests
+from loguru import logger
+
+from dock_worker.core import config
+from dock_worker.core.db import CachedImages, Jobs, get_db, init_db
+from dock_worker.schemas import JobInDB, JobStatusEnum
+from dock_worker.utils import execute_command, get_command_output, get_local_image_size, parse_size
+
+# 每次查询最近完成的任务数量
+RECENT_JOB_LIMIT = 100
+
+
+def get_images_in_use() -> set[str]:
+    """
+    :return: 所有容器(包括已停止的)引用的镜像名
+    """
+    output = get_command_output("docker ps -a --format {{.Image}}")
+    return set(output.split()) if output else set()
+
+
+class PrefetchDaemon:
+
+    def __init__(self, manager, patterns: list[str] | None = None, disk_budget: str | int | None = None,
+                 interval: float | None = None, api_url: str | None = None):
+        """
+        :param api_url: API 服务地址, 为空时读取本地数据库
+        """
+        self.manager = manager
+        self.patterns = patterns or config.prefetch_patterns
+        self.disk_budget = parse_size(disk_budget or config.prefetch_disk_budget)
+        self.interval = interval or config.prefetch_interval
+        self.api_url = api_url or config.prefetch_api_url
+
+    def run_forever(self):
+        init_db()
+        logger.info(f"Prefetch daemon started, {self.patterns=}, {self.disk_budget=}, {self.api_url=}")
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception(f"Prefetch tick failed: {e}")
+            time.sleep(self.interval)
+
+    def tick(self):
+        total = self.cached_size()
+        for job in self.pending_jobs():
+            # image_size 为仓库中的压缩大小, 作为本地大小的下限估算
+            if total + (job.image_size or 0) > self.disk_budget:
+                logger.info(f"Prefetch paused, {total=}, budget={self.disk_budget}, next: {job.source}")
+                break
+            if self.prefetch(job):
+                total = self.cached_size()
+        self.touch_images_in_use()
+        self.evict()
+
+    def cached_size(self) -> int:
+        """
+        :return: 本地预拉取且尚未淘汰的镜像总大小(字节)
+        """
+        with get_db() as session:
+            images = session.query(CachedImages).filter(CachedImages.evicted_at.is_(None)).all()
+            return sum(image.size or 0 for image in images)
+
+    def match(self, job: JobInDB) -> bool:
+        return any(fnmatch(job.source, p) or fnmatch(job.target, p) for p in self.patterns)
+
+    def completed_jobs(self) -> list[JobInDB]:
+        """
+        最近完成的任务, 按 id 从旧到新
+        """
+        if self.api_url:
+            response = requests.get(
+                f"{self.api_url.rstrip('/')}/jobs",
+                params={"status": JobStatusEnum.completed.value, "limit": RECENT_JOB_LIMIT},
+                timeout=30,
+            )
+            response.raise_for_status()
+            jobs = [JobInDB.model_validate(item) for item in response.json()]
+        else:
+            with get_db() as session:
+                jobs = [
+                    JobInDB.model_validate(job)
+                    for job in session.query(Jobs)
+                    .filter(Jobs.status == JobStatusEnum.completed)
+                    .order_by(Jobs.id.desc())
+                    .limit(RECENT_JOB_LIMIT)
+                    .all()
+                ]
+        return sorted(jobs, key=lambda job: job.id)
+
+    def pending_jobs(self) -> list[JobInDB]:
+        """
+        已完成, 匹配配置且尚未预拉取过的任务, 已淘汰的镜像不会再次拉取
+        """
+        with get_db() as session:
+            cached = {name for name, in session.query(CachedImages.full_name).all()}
+        pending = []
+        for job in self.completed_jobs():
+            full_name = self.manager.make_image_full_name(job.target)
+            if self.match(job) and full_name not in cached:
+                cached.add(full_name)
+                pending.append(job)
+        return pending
+
+    def prefetch(self, job: JobInDB) -> bool:
+        full_name = self.manager.make_image_full_name(job.target)
+        logger.info(f"Prefetching {full_name} as {job.source}")
+        if not self.manager.pull_image(job.target):
+            return False
+        if (size := get_local_image_size(full_name)) is None:
+            logger.error(f"Prefetch {full_name} failed, image not found after pull")
+            return False
+        self.manager.tag_image(job.target, job.source)
+
+        with get_db() as session:
+            session.add(CachedImages(job_id=job.id, full_name=full_name, local_name=job.source, size=size))
+            session.commit()
+        logger.success(f"Prefetched {full_name}, size: {size}")
+        return True
+
+    def touch_images_in_use(self):
+        in_use = get_images_in_use()
+        if not in_use:
+            return
+        with get_db() as session:
+            for image in session.query(CachedImages).filter(CachedImages.evicted_at.is_(None)).all():
+                if image.full_name in in_use or image.local_name in in_use:
+                    image.last_used_at = datetime.now()
+            session.commit()
+
+    def evict(self):
+        """
+        预拉取的镜像总大小超过预算时, 按最近使用时间从旧到新淘汰, 正在被容器引用的镜像不会被删除.
+        淘汰后记录 evicted_at 而不删除记录, 避免下次扫描时再次拉取
+        """
+        in_use = get_images_in_use()
+        with get_db() as session:
+            images = (
+                session.query(CachedImages)
+                .filter(CachedImages.evicted_at.is_(None))
+                .order_by(CachedImages.last_used_at)
+                .all()
+            )
+            total = sum(image.size or 0 for image in images)
+            for image in images:
+                if total <= self.disk_budget:
+                    break
+                if image.full_name in in_use or image.local_name in in_use:
+                    continue
+                logger.info(f"Evicting {image.full_name}, {total=}, budget={self.disk_budget}")
+                execute_command(f"docker rmi {image.local_name} {image.full_name}")
+                total -= image.size or 0
+                image.evicted_at = datetime.now()
+            session.commit()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Docker Registry HTTP API v2 的最小客户端, 用于在触发 workflow 前查看镜像清单
+"""
+import re
+
+import requests
+from loguru import logger
+from pydantic import BaseModel
+
+from dock_worker.core import config
+
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+
+INDEX_MEDIA_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+)
+MANIFEST_MEDIA_TYPES = (
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+)
+MANIFEST_ACCEPT = ", ".join(INDEX_MEDIA_TYPES + MANIFEST_MEDIA_TYPES)
+
+
+class ImageReference(BaseModel):
+    registry: str
+    repository: str
+    reference: str = "latest"
+
+    @property
+    def is_digest(self) -> bool:
+        return self.reference.startswith("sha256:")
+
+
+def parse_image_reference(image: str) -> ImageReference:
+    """
+    解析镜像名, 补全默认仓库地址与 tag
+
+    >>> parse_image_reference('ubuntu:20.04')
+    ImageReference(registry='registry-1.docker.io', repository='library/ubuntu', reference='20.04')
+    >>> parse_image_reference('ghcr.io/foo/bar')
+    ImageReference(registry='ghcr.io', repository='foo/bar', reference='latest')
+    >>> parse_image_reference('localhost:5000/foo/bar@sha256:abc')
+    ImageReference(registry='localhost:5000', repository='foo/bar', reference='sha256:abc')
+    """
+    image = image.removeprefix("docker://")
+    registry = DOCKER_HUB_REGISTRY
+    first, _, rest = image.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        registry, image = first, rest
+    if registry == "docker.io":
+        registry = DOCKER_HUB_REGISTRY
+
+    if "@" in image:
+        repository, reference = image.split("@", 1)
+    else:
+        repository, reference = image, "latest"
+        name, _, tag = image.rpartition(":")
+        if name and "/" not in tag:
+            repository, reference = name, tag
+    if registry == DOCKER_HUB_REGISTRY and "/" not in repository:
+        repository = f"library/{repository}"
+    return ImageReference(registry=registry, repository=repository, reference=reference)
+
+
+def registry_base_url(registry: str) -> str:
+    """
+    仓库地址带有 http(s):// 前缀时按原样使用, 配置在 insecure_registries 中的使用 http, 否则默认 https
+    """
+    if registry.startswith(("http://", "https://")):
+        return registry.rstrip("/")
+    if registry in config.insecure_registries:
+        return f"http://{registry}"
+    return f"https://{registry}"
+
+
+class RegistryClient:
+
+    def __init__(self, registry: str, proxies: dict | None = None, timeout: float = 10):
+        self.base_url = registry_base_url(registry)
+        self.proxies = proxies
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _fetch_token(self, challenge: str, repository: str) -> str | None:
+        """
+        按 WWW-Authenticate 中的 Bearer 参数匿名获取 pull token
+        """
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm", None)
+        if not realm:
+            return None
+        params.setdefault("scope", f"repository:{repository}:pull")
+        response = requests.get(realm, params=params, proxies=self.proxies, timeout=self.timeout)
+        if response.status_code != 200:
+            logger.warning(f"Fetch registry token failed: {response.status_code}")
+            return None
+        resp_json = response.json()
+        return resp_json.get("token") or resp_json.get("access_token")
+
+    def request(self, method: str, repository: str, path: str, **kwargs) -> requests.Response:
+        url = f"{self.base_url}/v2/{repository}/{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, url, proxies=self.proxies, **kwargs)
+        challenge = response.headers.get("WWW-Authenticate", "")
+        if response.status_code == 401 and challenge.lower().startswith("bearer"):
+            if token := self._fetch_token(challenge, repository):
+                headers = {**kwargs.pop("headers", {}), "Authorization": f"Bearer {token}"}
+                response = self.session.request(method, url, proxies=self.proxies, headers=headers, **kwargs)
+        return response
+
+    def get_manifest(self, repository: str, reference: str) -> dict | None:
+        response = self.request("GET", repository, f"manifests/{reference}", headers={"Accept": MANIFEST_ACCEPT})
+        if response.status_code != 200:
+            logger.debug(f"Get manifest {repository}:{reference} failed: {response.status_code}")
+            return None
+        return response.json()
+
+    def manifest_exists(self, repository: str, reference: str) -> bool:
+        response = self.request("HEAD", repository, f"manifests/{reference}", headers={"Accept": MANIFEST_ACCEPT})
+        return response.status_code == 200
+
+
+class ImageInspection(BaseModel):
+    platforms: list[str] = []
+    platform_sizes: dict[str, int] = {}  # 各平台压缩后的层大小总和(字节)
+
+    @property
+    def platform_count(self) -> int:
+        return max(len(self.platforms), 1)
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.platform_sizes.values())
+
+
+def _manifest_size(manifest: dict) -> int:
+    return sum(layer.get("size", 0) for layer in manifest.get("layers", []))
+
+
+def inspect_image(image: str, platform: str | None = None, proxies: dict | None = None) -> ImageInspection | None:
+    """
+    读取源镜像清单, 统计平台数量与压缩层大小
+    :param platform: 指定时只统计该平台的大小
+    :return: 清单读取失败时返回 None
+    """
+    ref = parse_image_reference(image)
+    client = RegistryClient(ref.registry, proxies=proxies)
+    try:
+        manifest = client.get_manifest(ref.repository, ref.reference)
+        if not manifest:
+            return None
+        if manifest.get("mediaType") not in INDEX_MEDIA_TYPES and "manifests" not in manifest:
+            return ImageInspection(platform_sizes={platform or "": _manifest_size(manifest)})
+
+        inspection = ImageInspection()
+        for item in manifest["manifests"]:
+            item_platform = item.get("platform", {})
+            # attestation 等附属清单的平台为 unknown/unknown
+            if item_platform.get("os", "unknown") == "unknown":
+                continue
+            name = "/".join(filter(None, [item_platform.get("os"), item_platform.get("architecture"),
+                                          item_platform.get("variant")]))
+            inspection.platforms.append(name)
+            if platform and name != platform and not name.startswith(f"{platform}/"):
+                continue
+            if sub_manifest := client.get_manifest(ref.repository, item["digest"]):
+                inspection.platform_sizes[name] = _manifest_size(sub_manifest)
+        return inspection
+    except requests.RequestException as e:
+        logger.warning(f"Inspect image {image} failed: {e}")
+        return None
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+workflow 失败后的自动重试
+
+根据 run 的 conclusion, 失败的步骤与日志判断失败是否是暂时性的(上游限流, 仓库超时, runner 环境问题),
+暂时性失败通过 rerun-failed-jobs 接口按指数退避重新运行, 超过最大次数后放弃.
+"""
+import re
+from enum import Enum
+
+from loguru import logger
+from pydantic import BaseModel
+
+from dock_worker.core import config
+
+
+class FailureKind(str, Enum):
+    transient = "transient"  # 可重试
+    permanent = "permanent"  # 镜像不存在, 无权限等, 重试无意义
+    cancelled = "cancelled"  # 被取消, 不重试
+
+
+# 准备 runner 环境的步骤, 在这些步骤失败与镜像本身无关
+SETUP_STEPS = {
+    "Set up job",
+    "Maximize build space",
+    "Restart docker",
+    "Checkout Code",
+    "Docker Setup Buildx",
+    "Install skopeo",
+}
+
+PERMANENT_PATTERNS = [
+    r"manifest unknown",
+    r"manifest for .* not found",
+    r"repository does not exist",
+    r"pull access denied",
+    r"unauthorized",
+    r"denied: requested access",
+    r"invalid reference format",
+    r"platform 格式错误",
+]
+
+TRANSIENT_PATTERNS = [
+    r"toomanyrequests",
+    r"429 Too Many Requests",
+    r"rate limit",
+    r"TLS handshake timeout",
+    r"i/o timeout",
+    r"context deadline exceeded",
+    r"connection reset by peer",
+    r"unexpected EOF",
+    r"50[234] (Bad Gateway|Service Unavailable|Gateway Timeout)",
+]
+
+
+def classify_log(log: str) -> FailureKind | None:
+    """
+    >>> classify_log('Error response from daemon: toomanyrequests: You have reached your pull rate limit.')
+    <FailureKind.transient: 'transient'>
+    >>> classify_log('Error response from daemon: manifest for foo:bar not found: manifest unknown')
+    <FailureKind.permanent: 'permanent'>
+    >>> classify_log('all good') is None
+    True
+    """
+    if any(re.search(p, log, re.IGNORECASE) for p in PERMANENT_PATTERNS):
+        return FailureKind.permanent
+    if any(re.search(p, log, re.IGNORECASE) for p in TRANSIENT_PATTERNS):
+        return FailureKind.transient
+    return None
+
+
+def classify_failure(manager, run_info: dict) -> FailureKind:
+    """
+    判断已完成但未成功的 run 是否值得重试
+    """
+    conclusion = run_info.get("conclusion")
+    if conclusion in ("cancelled", "skipped"):
+        return FailureKind.cancelled
+    if conclusion == "timed_out":
+        return FailureKind.transient
+    if conclusion == "startup_failure":
+        return FailureKind.permanent
+
+    for job in manager.get_workflow_run_jobs(run_info["id"]).get("jobs", []):
+        if job.get("conclusion") != "failure":
+            continue
+        failed_steps = [step["name"] for step in job.get("steps", []) if step.get("conclusion") == "failure"]
+        logger.info(f"Run {run_info['id']} job `{job['name']}` failed at {failed_steps}")
+        if failed_steps and all(step in SETUP_STEPS for step in failed_steps):
+            return FailureKind.transient
+        if kind := classify_log(manager.get_job_logs(job["id"])):
+            return kind
+    return FailureKind.permanent
+
+
+class RetryPolicy(BaseModel):
+    max_attempts: int = config.retry_max_attempts  # 包括第一次运行
+    backoff_base: float = config.retry_backoff_base  # 第一次重试前等待的秒数
+    backoff_max: float = config.retry_backoff_max
+
+    def should_retry(self, kind: FailureKind, attempt: int) -> bool:
+        return kind == FailureKind.transient and attempt < self.max_attempts
+
+    def backoff(self, attempt: int) -> float:
+        """
+        第 attempt 次运行失败后, 重试前等待的秒数
+
+        >>> RetryPolicy(backoff_base=30, backoff_max=100).backoff(1)
+        30.0
+        >>> RetryPolicy(backoff_base=30, backoff_max=100).backoff(3)
+        100.0
+        """
+        return float(min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+workflow 自动选择
+
+skopeo workflow 直接在仓库之间流式复制镜像层, 不占用 runner 磁盘, 中小镜像明显更快;
+docker workflow 需要先花几分钟释放 runner 磁盘空间, 只在镜像过大时才值得.
+"""
+from loguru import logger
+
+from dock_worker.core import config
+from dock_worker.registry import inspect_image
+from dock_worker.schemas import DOCKER_WORKFLOW_NAME, SKOPEO_WORKFLOW_NAME, RouteDecision
+from dock_worker.utils import parse_size
+
+# docker workflow 在 runner 上执行 docker pull, 只能得到该平台的镜像
+DOCKER_WORKFLOW_PLATFORM = "linux/amd64"
+
+
+def supports_platform(workflow_name: str) -> bool:
+    """
+    只有 skopeo workflow 声明了 platform 输入, 向其他 workflow 传入未声明的输入时 github 返回 422
+
+    >>> supports_platform('ApiDockerImagePusher')
+    False
+    """
+    return workflow_name == SKOPEO_WORKFLOW_NAME
+
+
+def format_size(size: int) -> str:
+    """
+    >>> format_size(1536 * 1024 ** 2)
+    '1.5GB'
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}" if unit != "B" else f"{size}B"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def choose_workflow(source: str, platform: str | None = None, proxies: dict | None = None) -> RouteDecision:
+    """
+    根据源镜像清单(压缩层大小, 平台数量)选择最快的可用 workflow
+    :param platform: 只需要单个架构时指定, 例如 linux/amd64
+    """
+    threshold = parse_size(config.auto_route_size_threshold)
+    inspection = inspect_image(source, platform=platform, proxies=proxies)
+    if not inspection:
+        if platform:
+            # 只有 skopeo workflow 能按指定平台复制, 无法读取清单时也不能退回 docker workflow
+            return RouteDecision(
+                workflow_name=SKOPEO_WORKFLOW_NAME,
+                platform=platform,
+                reason="source manifest unavailable, use skopeo workflow for the requested platform",
+            )
+        return RouteDecision(
+            workflow_name=DOCKER_WORKFLOW_NAME,
+            platform=None,
+            reason="source manifest unavailable, fallback to docker workflow",
+        )
+
+    if platform and inspection.platforms and not inspection.platform_sizes:
+        logger.warning(f"Platform {platform} not found in {source}, available: {inspection.platforms}")
+        platform = None
+        inspection = inspect_image(source, proxies=proxies) or inspection
+
+    # 单架构镜像无需再指定平台, 多架构镜像只需要一个架构时才传 platform
+    if inspection.platform_count <= 1:
+        platform = None
+    size = inspection.total_size
+    summary = f"{format_size(size)} across {len(inspection.platform_sizes) or 1} of {inspection.platform_count} platform(s)"
+
+    # 超大镜像且 docker workflow 能产出所需平台时, 才值得为释放磁盘付出额外的启动时间
+    docker_capable = platform in (None, DOCKER_WORKFLOW_PLATFORM) and (
+            inspection.platform_count <= 1 or platform == DOCKER_WORKFLOW_PLATFORM
+    )
+    if size > threshold and docker_capable:
+        return RouteDecision(
+            workflow_name=DOCKER_WORKFLOW_NAME,
+            platform=None,
+            image_size=size,
+            platform_count=inspection.platform_count,
+            reason=f"{summary} > {config.auto_route_size_threshold}, use docker workflow",
+        )
+    return RouteDecision(
+        workflow_name=SKOPEO_WORKFLOW_NAME,
+        platform=platform,
+        image_size=size,
+        platform_count=inspection.platform_count,
+        reason=f"{summary}, use skopeo workflow",
+    )
@@ -6,11 +6,16 @@ from pydantic import BaseModel
 
 from dock_worker.utils import normalize_image_name
 
+DOCKER_WORKFLOW_NAME = "ApiDockerImagePusher"  # api_hook.yaml, docker pull/push, 先释放 runner 磁盘空间
+SKOPEO_WORKFLOW_NAME = "ApiSkopeoImageCopier"  # api_skopeo_copy.yaml, skopeo 流式复制, 不落盘
+AUTO_WORKFLOW_NAME = "auto"  # 根据源镜像清单自动选择 workflow
+
 
 class ImageArgs(BaseModel):
     source: str
     target: str | None = None  # 私有仓库镜像, aliyun.com/your_space/{target}
     distinct_id: str | None = None
+    platform: str | None = None  # 仅复制单个架构, 例如 linux/amd64, 只有 skopeo workflow 支持
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -58,6 +63,16 @@ class WorkflowDetails(BaseModel):
 class TriggerRequest(BaseModel):
     source: str
     target: str | None = None
+    workflow: str | None = None  # 为空时使用配置中的 default_workflow_name, `auto` 表示自动选择
+    platform: str | None = None  # 仅 skopeo workflow 与 auto 支持
+
+
+class RouteDecision(BaseModel):
+    workflow_name: str
+    platform: str | None = None
+    image_size: int | None = None  # 需要复制的压缩层大小(字节)
+    platform_count: int | None = None
+    reason: str
 
 
 class JobBase(ImageArgs):
@@ -72,12 +87,23 @@ class JobBase(ImageArgs):
     workflow_id: int | None = None
     workflow_name: str | None = None
     full_url: str | None = None
+    image_size: int | None = None
+    platform_count: int | None = None
+    route_reason: str | None = None
+    attempt: int = 1
+    conclusion: str | None = None
+    next_retry_at: datetime | None = None
 
 
 class JobInDB(JobBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    dispatched_at: datetime | None = None
+    finished_at: datetime | None = None
+    expected_duration: float | None = None  # 按历史任务估算的总耗时(秒)
+    duration_stddev: float | None = None  # 历史耗时的标准差(秒), 用于给出耗时范围
+    eta_seconds: float | None = None  # 预计剩余时间(秒)
 
     class Config:
         from_attributes = True
@@ -93,6 +119,7 @@ class JobStatusEnum(str, Enum):
     in_progress = "in_progress"
     completed = "completed"
     failed = "failed"
+    cancelled = "cancelled"  # 被同一 target 的新请求取代
 
 
 status_2_progress_number = {
@@ -101,4 +128,5 @@ status_2_progress_number = {
     JobStatusEnum.in_progress: 50,
     JobStatusEnum.completed: 100,
     JobStatusEnum.failed: 0,
+    JobStatusEnum.cancelled: 0,
 }
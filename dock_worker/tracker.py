@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+API 的后台任务跟踪
+
+每个 worker 进程运行一个 JobTracker, 通过数据库中的租约认领未完成的任务,
+同一时刻每个任务只由一个 worker 负责触发 workflow 与轮询状态, 持有者失联后租约过期, 由其他 worker 接管.
+单 worker 部署时 /trigger 已触发 workflow, JobTracker 只负责轮询状态.
+任务状态写回数据库, 任意 worker 上的等待方通过轮询数据库获得通知.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import or_, update
+
+from dock_worker.core import config
+from dock_worker.core.db import Jobs, get_db
+from dock_worker.core.lease import claim_job_lease, hold_job_lease, lease_available_clause, release_job_lease, \
+    worker_id
+from dock_worker.eta import job_duration, record_duration, run_finished_at, with_eta
+from dock_worker.retry import FailureKind, RetryPolicy, classify_failure
+from dock_worker.schemas import ImageArgs, JobInDB, JobStatusEnum
+
+ACTIVE_STATUSES = [JobStatusEnum.pending, JobStatusEnum.queued, JobStatusEnum.in_progress]
+TERMINAL_STATUSES = [JobStatusEnum.completed, JobStatusEnum.failed, JobStatusEnum.cancelled]
+
+# 触发后超过该时间仍未找到对应的 workflow run, 视为失败
+RUN_LOOKUP_TIMEOUT = timedelta(minutes=5)
+# 只取消该时间内创建的旧任务, 更早的任务由 JobTracker 轮询到实际状态
+SUPERSEDE_WINDOW = timedelta(hours=6)
+
+
+def job_status(run_status: str) -> str:
+    """
+    github run 的状态映射为任务状态, requested/waiting/pending 等尚未开始运行的状态都视为 queued,
+    保证未结束的任务仍在 ACTIVE_STATUSES 中, 会被继续轮询
+
+    >>> job_status('waiting')
+    'queued'
+    """
+    if run_status in (JobStatusEnum.completed, JobStatusEnum.in_progress):
+        return run_status
+    return JobStatusEnum.queued.value
+
+
+class JobTracker:
+
+    def __init__(self, owner: str | None = None, poll_interval: float | None = None,
+                 retry_policy: RetryPolicy | None = None):
+        self.owner = owner or worker_id()
+        self.poll_interval = poll_interval or config.poll_interval
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def manager(self):
+        from dock_worker.trigger import get_action_trigger
+        return get_action_trigger()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name=f"job-tracker-{self.owner}", daemon=True)
+        self._thread.start()
+        logger.info(f"Job tracker started, worker: {self.owner}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval * 2)
+        logger.info(f"Job tracker stopped, worker: {self.owner}")
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception(f"Job tracker tick failed: {e}")
+            self._stop_event.wait(self.poll_interval)
+
+    def claimable_job_ids(self) -> list[int]:
+        with get_db() as session:
+            rows = (
+                session.query(Jobs.id)
+                .filter(Jobs.status.in_(ACTIVE_STATUSES))
+                .filter(lease_available_clause(self.owner, datetime.now()))
+                .order_by(Jobs.id)
+                .all()
+            )
+        return [row.id for row in rows]
+
+    def tick(self):
+        for job_id in self.claimable_job_ids():
+            if not claim_job_lease(job_id, owner=self.owner):
+                continue
+            try:
+                self.process_job(job_id)
+            except Exception as e:
+                logger.exception(f"Process job {job_id} failed: {e}")
+
+    def process_job(self, job_id: int):
+        with get_db() as session:
+            job = session.get(Jobs, job_id)
+            if not job or job.lease_owner != self.owner:
+                return
+            previous_status = job.status
+            if job.cancel_requested_at and self.cancel_job(job):
+                pass
+            elif job.dispatched_at is None:
+                self.dispatch_job(job)
+            else:
+                self.poll_job(job)
+            # github 请求期间租约可能已过期并被其他 worker 接管, 此时丢弃本次结果, 由新的持有者处理
+            if not hold_job_lease(session, job_id, owner=self.owner):
+                session.rollback()
+                logger.warning(f"Lost lease of job {job_id}, discard result")
+                return
+            session.commit()
+            finished = job.status in TERMINAL_STATUSES
+            if job.status == JobStatusEnum.completed and previous_status != JobStatusEnum.completed:
+                record_duration(job.workflow_name, job.source, job.image_size, job_duration(job))
+        if finished:
+            release_job_lease(job_id, owner=self.owner)
+
+    def dispatch_job(self, job: Jobs):
+        workflow = next(
+            (wf for wf in self.manager.workflows.workflows if wf.id == job.workflow_id),
+            None,
+        )
+        if not workflow:
+            logger.error(f"Workflow `{job.workflow_id}` not found, job: {job.distinct_id}")
+            job.status = JobStatusEnum.failed
+            return
+        image_args = ImageArgs(
+            source=job.source, target=job.target, distinct_id=job.distinct_id, platform=job.platform
+        )
+        if not self.manager.create_workflow_dispatch_event(workflow=workflow, image_args=image_args):
+            job.status = JobStatusEnum.failed
+            return
+        job.dispatched_at = datetime.now()
+
+    def find_run(self, job: Jobs) -> dict | None:
+        """
+        :return: 任务对应的 workflow run, 首次找到时写入 run_id, 尚未出现时返回 None
+        """
+        if job.run_id:
+            return self.manager.get_workflow_run_info(run_id=job.run_id)
+        run_info = self.manager.find_run_by_distinct_id(job.workflow_id, job.distinct_id)
+        if run_info:
+            job.run_id = run_info["id"]
+            job.run_number = run_info["run_number"]
+        return run_info
+
+    def cancel_job(self, job: Jobs) -> bool:
+        """
+        取消被新任务取代的任务, 只取消 github 上仍未结束的 run
+        :return: 是否已取消; run 尚未出现或已经结束时返回 False, 由 poll_job 继续查找或写入实际状态
+        """
+        if job.dispatched_at and not job.next_retry_at:
+            run_info = self.find_run(job)
+            if not run_info or run_info.get("status") == JobStatusEnum.completed:
+                return False
+            if not self.manager.cancel_workflow_run(run_info["id"]):
+                logger.warning(f"Cancel workflow run {run_info['id']} failed, job: {job.distinct_id}")
+                return False
+        logger.info(f"Job {job.distinct_id} cancelled")
+        job.status = JobStatusEnum.cancelled
+        job.next_retry_at = None
+        return True
+
+    def poll_job(self, job: Jobs):
+        if job.next_retry_at:
+            if datetime.now() >= job.next_retry_at:
+                self.retry_job(job)
+            return
+
+        run_info = self.find_run(job)
+        if not run_info:
+            if not job.run_id and datetime.now() - job.dispatched_at > RUN_LOOKUP_TIMEOUT:
+                logger.error(f"Workflow run not found for job {job.distinct_id}")
+                job.status = JobStatusEnum.failed
+            return
+
+        if run_info.get("run_attempt", 1) < (job.attempt or 1):
+            # 重新运行的请求已提交, github 尚未开始新一轮
+            return
+        status = job_status(run_info["status"])
+        if status == JobStatusEnum.completed:
+            job.conclusion = run_info.get("conclusion")
+            if job.conclusion != "success":
+                logger.warning(f"Workflow run {job.run_id} completed, conclusion: {job.conclusion}")
+                status = self.handle_failure(job, run_info)
+        if job.status != status:
+            logger.info(f"Job {job.distinct_id} status: {job.status} -> {status}")
+            job.status = status
+            if status == JobStatusEnum.completed:
+                job.finished_at = run_finished_at(run_info)
+
+    def handle_failure(self, job: Jobs, run_info: dict) -> str:
+        """
+        :return: 失败后任务的状态, 需要重试时为 queued 并写入 next_retry_at
+        """
+        kind = classify_failure(self.manager, run_info)
+        attempt = job.attempt or 1
+        if kind == FailureKind.cancelled:
+            return JobStatusEnum.cancelled
+        if not self.retry_policy.should_retry(kind, attempt):
+            logger.warning(f"Job {job.distinct_id} failed ({kind.value}) after {attempt} attempt(s)")
+            return JobStatusEnum.failed
+        delay = self.retry_policy.backoff(attempt)
+        logger.info(f"Job {job.distinct_id} failed ({kind.value}), retry in {delay}s")
+        job.next_retry_at = datetime.now() + timedelta(seconds=delay)
+        return JobStatusEnum.queued
+
+    def retry_job(self, job: Jobs):
+        job.next_retry_at = None
+        if not self.manager.rerun_failed_jobs(job.run_id):
+            logger.error(f"Rerun workflow run {job.run_id} failed, job: {job.distinct_id}")
+            job.status = JobStatusEnum.failed
+            return
+        job.attempt = (job.attempt or 1) + 1
+        job.conclusion = None
+        logger.info(f"Job {job.distinct_id} rerun, attempt: {job.attempt}")
+
+
+def cancel_superseded_jobs(job: Jobs) -> list[str]:
+    """
+    同一个 target 有了更新的任务时, 取消最近仍在排队或运行中的旧任务, 把 runner 留给新任务.
+    无人持有租约且尚未触发的任务直接取消; 其余任务只标记, 由持有租约的 JobTracker 取消 github 上仍未结束的 run,
+    run 已经结束的任务保持原状, 由 JobTracker 写入实际状态
+    :return: 被取消或标记取消的任务 distinct_id
+    """
+    now = datetime.now()
+    superseded = []
+    with get_db() as session:
+        old_jobs = (
+            session.query(Jobs.id, Jobs.distinct_id)
+            .filter(Jobs.target == job.target)
+            .filter(Jobs.repo_namespace == job.repo_namespace)
+            .filter(Jobs.status.in_(ACTIVE_STATUSES))
+            .filter(Jobs.created_at > now - SUPERSEDE_WINDOW)
+            .filter(Jobs.id < job.id)
+            .all()
+        )
+        for old_job in old_jobs:
+            # 条件更新, 避免与正在触发该任务的 worker 竞争
+            result = session.execute(
+                update(Jobs)
+                .where(Jobs.id == old_job.id)
+                .where(Jobs.dispatched_at.is_(None))
+                .where(Jobs.status.in_(ACTIVE_STATUSES))
+                .where(or_(Jobs.lease_owner.is_(None), Jobs.lease_expires_at < now))
+                .values(status=JobStatusEnum.cancelled, cancel_requested_at=now)
+            )
+            if not result.rowcount:
+                session.execute(update(Jobs).where(Jobs.id == old_job.id).values(cancel_requested_at=now))
+            logger.info(f"Job {old_job.distinct_id} superseded by {job.distinct_id}")
+            superseded.append(old_job.distinct_id)
+        session.commit()
+    return superseded
+
+
+async def wait_for_job(distinct_id: str, timeout: float = 600, poll_interval: float | None = None) -> JobInDB | None:
+    """
+    等待任务进入终态, 状态由持有租约的 worker 写入数据库, 因此可以在任意 worker 上等待
+    :return: 最新的任务信息, 任务不存在时返回 None
+    """
+    poll_interval = poll_interval or config.poll_interval
+    deadline = time.monotonic() + timeout
+    while True:
+        with get_db() as session:
+            job = session.query(Jobs).filter(Jobs.distinct_id == distinct_id).first()
+            job_info = with_eta(JobInDB.model_validate(job)) if job else None
+        if not job_info or job_info.status in TERMINAL_STATUSES or time.monotonic() >= deadline:
+            return job_info
+        await asyncio.sleep(poll_interval)
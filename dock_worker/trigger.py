@@ -1,4 +1,5 @@
 import time
+from functools import cached_property, lru_cache
 from typing import Any
 
 import requests
@@ -6,7 +7,7 @@ from loguru import logger
 
 from dock_worker.core import config
 from dock_worker.schemas import ImageArgs, Workflow, WorkflowsResponse, WorkflowDetails, JobStatusEnum, \
-    status_2_progress_number
+    status_2_progress_number, RouteDecision
 from dock_worker.utils import execute_command
 
 
@@ -38,6 +39,8 @@ class GitHubActionManager:
     github_repo = config.github_repo
     name_space = config.name_space
     image_repositories_endpoint = config.image_repositories_endpoint
+    # github 请求超时(秒), 需小于 lease_ttl, 避免请求未返回时租约已被其他 worker 接管
+    timeout = 10
 
     @property
     def headers(self):
@@ -48,18 +51,40 @@ class GitHubActionManager:
         }
 
     def __init__(self):
-        self.workflows = self.get_workflows()
         self.workflow_name = config.default_workflow_name
-        self.workflow: Workflow = next(
-            (wf for wf in self.workflows.workflows if wf.name == self.workflow_name),
+
+    @cached_property
+    def workflows(self) -> WorkflowsResponse:
+        # 首次使用时才请求 github, prefetch/seed/serve 等不触发 workflow 的命令不依赖 github api
+        return self.get_workflows()
+
+    @cached_property
+    def workflow(self) -> Workflow | None:
+        return self.get_workflow_by_name(self.workflow_name)
+
+    def get_workflow_by_name(self, workflow_name: str) -> Workflow | None:
+        return next(
+            (wf for wf in self.workflows.workflows if wf.name == workflow_name),
             None,
         )
 
+    def route_image(self, image_args: ImageArgs) -> tuple[Workflow | None, RouteDecision]:
+        """
+        根据源镜像清单自动选择 workflow, 需要单架构时写入 image_args.platform
+        """
+        from dock_worker.routing import choose_workflow
+
+        decision = choose_workflow(image_args.source, platform=image_args.platform, proxies=self.proxy)
+        logger.info(f"Auto route: {decision.workflow_name}, {decision.reason}")
+        image_args.platform = decision.platform
+        return self.get_workflow_by_name(decision.workflow_name), decision
+
     def get_workflows(self) -> WorkflowsResponse:
         response = requests.get(
             url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/actions/workflows",
             headers=self.headers,
             proxies=self.proxy,
+            timeout=self.timeout,
         )
         resp_json = response.json()
         logger.debug(f"get workers: {resp_json}")
@@ -72,6 +97,7 @@ class GitHubActionManager:
                 f"actions/workflows/{workflow_id}",
             headers=self.headers,
             proxies=self.proxy,
+            timeout=self.timeout,
         )
         resp_json = response.json()
         res = WorkflowDetails.model_validate(resp_json)
@@ -94,6 +120,7 @@ class GitHubActionManager:
                 f"actions/workflows/{workflow_id}/runs",
             headers=self.headers,
             proxies=self.proxy,
+            timeout=self.timeout,
             params=query_params,
         )
         resp_json = response.json()
@@ -109,10 +136,53 @@ class GitHubActionManager:
             url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/actions/runs/{run_id}",
             headers=self.headers,
             proxies=self.proxy,
+            timeout=self.timeout,
         )
         resp_json = response.json()
         return resp_json
 
+    def get_workflow_run_jobs(self, run_id) -> dict:
+        response = requests.get(
+            url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/actions/runs/{run_id}/jobs",
+            headers=self.headers,
+            proxies=self.proxy,
+            timeout=self.timeout,
+        )
+        return response.json()
+
+    def get_job_logs(self, job_id) -> str:
+        response = requests.get(
+            url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/actions/jobs/{job_id}/logs",
+            headers=self.headers,
+            proxies=self.proxy,
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            logger.warning(f"Get job {job_id} logs failed: {response.status_code}")
+            return ""
+        return response.text
+
+    def rerun_failed_jobs(self, run_id) -> bool:
+        response = requests.post(
+            url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/"
+                f"actions/runs/{run_id}/rerun-failed-jobs",
+            headers=self.headers,
+            proxies=self.proxy,
+            timeout=self.timeout,
+        )
+        logger.debug(f"{response.text=}")
+        return response.status_code == 201
+
+    def cancel_workflow_run(self, run_id) -> bool:
+        response = requests.post(
+            url=f"{self.api_endpoint}/repos/{self.github_username}/{self.github_repo}/actions/runs/{run_id}/cancel",
+            headers=self.headers,
+            proxies=self.proxy,
+            timeout=self.timeout,
+        )
+        logger.debug(f"{response.text=}")
+        return response.status_code == 202
+
     def create_workflow_dispatch_event(
             self,
             workflow: Workflow | WorkflowDetails,
@@ -127,9 +197,10 @@ class GitHubActionManager:
                 f"actions/workflows/{workflow.id}/dispatches",
             headers=self.headers,
             proxies=self.proxy,
+            timeout=self.timeout,
             json={
                 "ref": ref,
-                "inputs": image_args.model_dump(),
+                "inputs": image_args.model_dump(exclude_none=True),
             },
         )
         logger.debug(f"{response.text=}")
@@ -160,39 +231,71 @@ class GitHubActionManager:
             return False
         return True
 
-    def fork_image(self, image_args: ImageArgs, test_mode=False):
+    def build_job(self, image_args: ImageArgs, workflow: Workflow | None = None,
+                  route: RouteDecision | None = None):
+        from dock_worker.schemas import JobNew
+
+        workflow = workflow or self.workflow
+        return JobNew(
+            source=image_args.source,
+            target=image_args.target,
+            distinct_id=image_args.distinct_id,
+            platform=image_args.platform,
+            repo_url=config.image_repositories_endpoint,
+            repo_namespace=self.name_space,
+            workflow_id=workflow.id,
+            workflow_name=workflow.name,
+            full_url=self.make_image_full_name(image_args.target),
+            image_size=route.image_size if route else None,
+            platform_count=route.platform_count if route else None,
+            route_reason=route.reason if route else None,
+        )
+
+    def fork_image(self, image_args: ImageArgs, test_mode=False, workflow: Workflow | None = None,
+                   route: RouteDecision | None = None):
         """
         Forks a Docker image from the origin to the self repository.
+        :param workflow: 为空时使用 self.workflow
+        :param route: 自动选择 workflow 的结果, 记录到任务信息中
         :return: True if the workflow was triggered successfully, False otherwise.
         """
         logger.debug(f"{image_args=}")
 
-        if not self.workflow:
+        workflow = workflow or self.workflow
+        if not workflow:
             logger.error(f"Workflow `{self.workflow_name}` not found.")
             return False
 
         if not test_mode:
             if not self.create_workflow_dispatch_event(
-                    workflow=self.workflow, image_args=image_args
+                    workflow=workflow, image_args=image_args
             ):
                 return False
 
-        from dock_worker.schemas import JobNew
+        return self.build_job(image_args, workflow=workflow, route=route)
 
-        return JobNew(
-            source=image_args.source,
-            target=image_args.target,
-            distinct_id=image_args.distinct_id,
-            repo_url=config.image_repositories_endpoint,
-            repo_namespace=self.name_space,
-            workflow_id=self.workflow.id,
-            workflow_name=self.workflow.name,
-            full_url=self.make_image_full_name(image_args.target),
-        )
-
-    def wait_for_workflow_complete(self, image_args: ImageArgs, test_mode=False, using_db: bool = False):
+    def wait_for_workflow_complete(self, image_args: ImageArgs, test_mode=False, using_db: bool = False,
+                                   retry_policy=None):
         # 每隔2s发一次请求, 查看状态是否是 completed
         from rich.progress import Progress
+        from dock_worker.retry import RetryPolicy, classify_failure
+        try:
+            from dock_worker.core.db import init_db
+            from dock_worker.eta import estimate_duration, format_duration, record_duration
+            init_db()
+        except ImportError as e:
+            # 历史耗时记录在本地数据库中, 缺少 sqlalchemy 时不影响转存, 只按状态显示固定进度
+            logger.warning(f"ETA disabled: {e}")
+            estimate_duration = record_duration = None
+
+        retry_policy = retry_policy or RetryPolicy()
+        attempt = 1
+        start_time = time.time()
+        image_size = getattr(image_args, "image_size", None)
+        # 有历史数据时按预计耗时显示进度与 ETA, 否则按状态显示固定进度
+        expected = None
+        if image_args.source and estimate_duration:
+            expected = estimate_duration(self.workflow.name, image_args.source, image_size)
 
         with Progress() as progress:
             running_job_id, updated = self.get_run_id_by_distinct_id(image_args, test_mode, using_db)
@@ -205,22 +308,50 @@ class GitHubActionManager:
 
             logger.info(f"Action Detail: https://github.com/leowzz/dock_worker/actions/runs/{running_job_id}")
             logger.info(f"Wait for the job to be completed, then you can pull the image. \n{self.make_image_full_name(image_args.target)}")
-            task_id = progress.add_task(f"Waiting for workflow run {running_job_id} to complete", total=100)
-            progress.update(task_id, completed=20)
+            task_id = progress.add_task(f"Waiting for workflow run {running_job_id} to complete",
+                                        total=expected or 100)
+            progress.update(task_id, completed=0 if expected else 20)
             while True:
                 current_run = self.get_workflow_run_info(run_id=running_job_id)
+                if current_run.get("run_attempt", 1) < attempt:
+                    # 重新运行尚未开始
+                    time.sleep(1)
+                    continue
                 status = current_run['status']
                 if status not in JobStatusEnum.__members__.values():
                     logger.warning(f"Unknown status: {status}")
+                elif expected:
+                    elapsed = time.time() - start_time
+                    progress.update(
+                        task_id,
+                        completed=min(elapsed, expected * 0.99),
+                        description=f"Workflow run {running_job_id} {status}, "
+                                    f"ETA {format_duration(max(expected - elapsed, 0))}",
+                    )
                 else:
                     progress.update(task_id, completed=status_2_progress_number[status])
 
                 if status == JobStatusEnum.completed:
                     if current_run["conclusion"] == "success":
+                        progress.update(task_id, completed=expected or 100)
+                        if image_args.source and record_duration:
+                            record_duration(self.workflow.name, image_args.source, image_size,
+                                            time.time() - start_time)
                         break
-                    else:
-                        logger.warning(f"Workflow {status}, but conclusion is not success")
+                    logger.warning(f"Workflow {status}, but conclusion is {current_run['conclusion']}")
+                    kind = classify_failure(self, current_run)
+                    if not retry_policy.should_retry(kind, attempt):
+                        logger.error(f"Workflow failed ({kind.value}) after {attempt} attempt(s)")
+                        return False
+                    delay = retry_policy.backoff(attempt)
+                    logger.info(f"Workflow failed ({kind.value}), retry in {delay}s")
+                    time.sleep(delay)
+                    if not self.rerun_failed_jobs(running_job_id):
+                        logger.error(f"Rerun workflow run {running_job_id} failed")
                         return False
+                    attempt += 1
+                    if not expected:
+                        progress.update(task_id, completed=status_2_progress_number[JobStatusEnum.queued])
                 time.sleep(1)
         logger.success(
             f"Workflow completed successfully!\n"
@@ -228,6 +359,16 @@ class GitHubActionManager:
         )
         return True
 
+    def find_run_by_distinct_id(self, workflow_id, distinct_id) -> dict | None:
+        """
+        单次查询 workflow 最近的运行记录, 返回 run-name 中带有 distinct_id 的那一次
+        """
+        workflow_runs = self.get_workflow_runs(workflow_id)
+        for run_info in workflow_runs.get("workflow_runs", []):
+            if f"[{distinct_id}]" in run_info["name"]:
+                return run_info
+        return None
+
     def get_run_id_by_distinct_id(self, image_args, test_mode, using_db) -> tuple[int, bool | Any]:
         start_time = time.time()
         while True:
@@ -258,8 +399,16 @@ class GitHubActionManager:
             time.sleep(1)
 
 
-action_trigger = GitHubActionManager()
+@lru_cache
+def get_action_trigger() -> GitHubActionManager:
+    """
+    每个进程只创建一次 GitHubActionManager, 多 worker 部署时各 worker 在首次使用时才各自初始化
+    """
+    return GitHubActionManager()
+
+
 if __name__ == "__main__":
+    action_trigger = get_action_trigger()
     action_trigger.fork_image(ImageArgs(source="ubuntu:20.04", target=None))
 
     # workflows = action_trigger.get_workflows()
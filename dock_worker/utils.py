@@ -1,4 +1,6 @@
 import os
+import shlex
+import subprocess
 from typing import TypeAlias, Literal
 
 from loguru import logger
@@ -40,3 +42,49 @@ def execute_command(command: str) -> bool:
     except Exception as e:
         logger.error(f"Command execution failed: {e}")
         return False
+
+
+def get_command_output(command: str) -> str | None:
+    """
+    执行命令并返回标准输出, 命令失败时返回 None
+    """
+    try:
+        logger.debug(f"Executing command: {command}")
+        result = subprocess.run(shlex.split(command), capture_output=True, text=True)
+    except Exception as e:
+        logger.error(f"Command execution failed: {e}")
+        return None
+    if result.returncode != 0:
+        logger.debug(f"Command exited with {result.returncode}: {result.stderr.strip()}")
+        return None
+    return result.stdout
+
+
+def get_local_image_size(image_name: str) -> int | None:
+    """
+    :return: 本地镜像大小(字节), 镜像不存在时返回 None
+    """
+    output = get_command_output(f"docker image inspect --format {{{{.Size}}}} {image_name}")
+    if not output:
+        return None
+    return int(output.strip())
+
+
+def parse_size(size: str | int) -> int:
+    """
+    将 `20G`, `512M` 这类容量描述转换为字节数
+
+    >>> parse_size('512M')
+    536870912
+    >>> parse_size('1.5g')
+    1610612736
+    >>> parse_size(1024)
+    1024
+    """
+    if isinstance(size, int):
+        return size
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = size.strip().upper().removesuffix('B').removesuffix('I')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
@@ -1,12 +1,232 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 
 import pytest
 
 
-@pytest.fixture(scope="session")
-def db():
+@pytest.fixture
+def db_engine(tmp_path, monkeypatch):
+    """
+    每个测试使用临时目录中的独立数据库, 不读写 ~/.config 下的真实数据库
+    """
+    from sqlalchemy import create_engine, event
+    from dock_worker.core import db as db_module
+
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'dock_worker.sqlite'}", connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    event.listen(engine, "connect", db_module._set_sqlite_pragma)
+    original_engine = db_module.engine
+    monkeypatch.setattr(db_module, "engine", engine)
+    db_module.SessionLocal.configure(bind=engine)
+    yield engine
+    db_module.SessionLocal.configure(bind=original_engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(db_engine):
     from dock_worker.core.db import init_db, get_db
     init_db()
     with get_db() as db:
         yield db
+
+
+class FakeRegistry:
+    """
+    本地 Registry v2 替身, 只实现清单与镜像层的读取
+    """
+
+    def __init__(self):
+        self.manifests: dict[tuple[str, str], dict] = {}
+        self.blobs: dict[tuple[str, str], bytes] = {}
+        self.requests: list[tuple[str, str]] = []
+        self.server = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def add_manifest(self, repository: str, reference: str, manifest: dict) -> str:
+        body = json.dumps(manifest).encode()
+        digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+        self.manifests[(repository, reference)] = manifest
+        self.manifests[(repository, digest)] = manifest
+        return digest
+
+    def make_handler(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, send_body: bool):
+                registry.requests.append((self.command, self.path))
+                if self.path.rstrip("/") == "/v2":
+                    return self._send(200, b"{}", "application/json", send_body)
+                repository, kind, reference = self.path[len("/v2/"):].rsplit("/", 2)
+                if kind == "manifests" and (manifest := registry.manifests.get((repository, reference))):
+                    body = json.dumps(manifest).encode()
+                    return self._send(200, body, manifest.get("mediaType", "application/json"), send_body)
+                if kind == "blobs" and (blob := registry.blobs.get((repository, reference))):
+                    return self._send(200, blob, "application/octet-stream", send_body)
+                return self._send(404, b'{"errors": []}', "application/json", send_body)
+
+            def _send(self, status, body, content_type, send_body):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Docker-Content-Digest", f"sha256:{hashlib.sha256(body).hexdigest()}")
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+        return Handler
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    from dock_worker.core import config
+
+    registry = FakeRegistry()
+    registry.server = ThreadingHTTPServer(("127.0.0.1", 0), registry.make_handler())
+    thread = threading.Thread(target=registry.server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(config, "insecure_registries", [registry.address])
+    yield registry
+    registry.server.shutdown()
+    registry.server.server_close()
+
+
+class FakeManager:
+    """
+    GitHubActionManager 替身: 每次触发 workflow 生成一个 run, run 的状态, 结论, 耗时与日志可配置
+    """
+
+    def __init__(self):
+        self.run_status = "completed"
+        self.conclusion = "success"
+        self.run_duration = 0  # run 完成时间与触发时间之差(秒)
+        self.log = ""
+        self.on_fork = None  # 触发时的回调, 参数为 image_args
+        self.pull_result = True
+        self.runs: dict[str, dict] = {}
+        self.workflows = SimpleNamespace(workflows=[self.get_workflow_by_name("ApiDockerImagePusher")])
+        self.dispatched, self.pulled, self.tagged, self.reruns, self.cancelled = [], [], [], [], []
+
+    @property
+    def forked(self) -> list[str]:
+        return [image_args.source for image_args in self.dispatched]
+
+    def get_workflow_by_name(self, workflow_name):
+        return SimpleNamespace(id=1, name=workflow_name)
+
+    def add_run(self, distinct_id: str | None = None, **fields) -> dict:
+        run_id = len(self.runs) + 1
+        finished_at = datetime.now() + timedelta(seconds=self.run_duration)
+        run = {
+            "id": run_id,
+            "run_number": run_id,
+            "run_attempt": 1,
+            "name": f"Mirror [{distinct_id}]",
+            "status": self.run_status,
+            "conclusion": self.conclusion if self.run_status == "completed" else None,
+            "updated_at": finished_at.astimezone(timezone.utc).isoformat(),
+            **fields,
+        }
+        self.runs[str(run_id)] = run
+        return run
+
+    def create_workflow_dispatch_event(self, workflow, image_args, ref="main"):
+        self.dispatched.append(image_args)
+        self.add_run(image_args.distinct_id)
+        if self.on_fork:
+            self.on_fork(image_args)
+        return True
+
+    def build_job(self, image_args, workflow=None, route=None):
+        from dock_worker.schemas import JobNew
+
+        workflow = workflow or self.get_workflow_by_name("ApiDockerImagePusher")
+        return JobNew(
+            source=image_args.source,
+            target=image_args.target,
+            distinct_id=image_args.distinct_id,
+            platform=image_args.platform,
+            workflow_id=workflow.id,
+            workflow_name=workflow.name,
+            image_size=route.image_size if route else None,
+        )
+
+    def fork_image(self, image_args, test_mode=False, workflow=None, route=None):
+        workflow = workflow or self.get_workflow_by_name("ApiDockerImagePusher")
+        if not self.create_workflow_dispatch_event(workflow, image_args):
+            return False
+        return self.build_job(image_args, workflow=workflow, route=route)
+
+    def find_run_by_distinct_id(self, workflow_id, distinct_id):
+        return next((run for run in self.runs.values() if f"[{distinct_id}]" in run["name"]), None)
+
+    def get_workflow_run_info(self, run_id):
+        return self.runs.get(str(run_id))
+
+    def get_workflow_run_jobs(self, run_id):
+        return {"jobs": [{
+            "id": run_id,
+            "name": "copy",
+            "conclusion": "failure",
+            "steps": [{"name": "Copy image", "conclusion": "failure"}],
+        }]}
+
+    def get_job_logs(self, job_id):
+        return self.log
+
+    def rerun_failed_jobs(self, run_id):
+        self.reruns.append(str(run_id))
+        run = self.runs[str(run_id)]
+        run.update(status="queued", conclusion=None, run_attempt=run["run_attempt"] + 1)
+        return True
+
+    def cancel_workflow_run(self, run_id):
+        self.cancelled.append(str(run_id))
+        self.runs[str(run_id)].update(status="completed", conclusion="cancelled")
+        return True
+
+    def make_image_full_name(self, image_name):
+        return f"registry.local/ns/{image_name}"
+
+    def pull_image(self, image_name):
+        self.pulled.append(image_name)
+        return self.pull_result
+
+    def tag_image(self, source_image, target_image):
+        self.tagged.append((source_image, target_image))
+        return True
+
+
+@pytest.fixture
+def fake_manager(monkeypatch):
+    """
+    替换 API 与 JobTracker 使用的 GitHubActionManager
+    """
+    from dock_worker import app as app_module
+    from dock_worker import trigger
+
+    manager = FakeManager()
+    monkeypatch.setattr(app_module, "get_action_trigger", lambda: manager)
+    monkeypatch.setattr(trigger, "get_action_trigger", lambda: manager)
+    return manager
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import io
+import json
+import tarfile
+import threading
+
+import pytest
+
+from dock_worker import distribute
+from dock_worker.distribute import LayerStore, fetch_from_peers, make_server
+from dock_worker.schemas import ImageArgs
+
+IMAGE = "registry.local/ns/ubuntu:20.04"
+MEMBERS = {
+    "blobs/sha256/config": b'{"architecture": "amd64"}',
+    "blobs/sha256/layer1": b"layer-1" * 1000,
+    "blobs/sha256/layer2": b"layer-2" * 1000,
+}
+
+
+def make_docker_save_archive(path):
+    manifest = [{
+        "Config": "blobs/sha256/config",
+        "RepoTags": [IMAGE],
+        "Layers": ["blobs/sha256/layer1", "blobs/sha256/layer2"],
+    }]
+    with tarfile.open(path, "w") as tar:
+        for name, body in {**MEMBERS, "manifest.json": json.dumps(manifest).encode()}.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+
+
+@pytest.fixture
+def seed_store(tmp_path):
+    store = LayerStore(str(tmp_path / "seed"))
+    make_docker_save_archive(tmp_path / "image.tar")
+    store.import_archive(str(tmp_path / "image.tar"), IMAGE)
+    server = make_server(store, host="127.0.0.1", port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield store, f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_from_peers(seed_store, tmp_path):
+    store, peer = seed_store
+    local = LayerStore(str(tmp_path / "local"))
+
+    # 已有的层不再下载, 不可用的 peer 被跳过
+    shared_layer = local.put_blob(io.BytesIO(MEMBERS["blobs/sha256/layer1"]))
+    index = fetch_from_peers(IMAGE, ["127.0.0.1:1", peer], local)
+    assert index == store.load_index(IMAGE)
+    assert shared_layer in index.layers
+    assert all(local.has_blob(digest) for digest in index.digests)
+
+    local.export_archive(index, str(tmp_path / "load.tar"))
+    with tarfile.open(tmp_path / "load.tar") as tar:
+        manifest = json.load(tar.extractfile("manifest.json"))[0]
+        assert manifest["RepoTags"] == [IMAGE]
+        contents = [tar.extractfile(name).read() for name in [manifest["Config"], *manifest["Layers"]]]
+    assert contents == list(MEMBERS.values())
+
+    assert fetch_from_peers("missing:latest", [peer], local) is None
+
+
+@pytest.mark.parametrize("serve", [False, True])
+def test_pull_with_peers_fallback(tmp_path, fake_manager, monkeypatch, serve):
+    exported = []
+    monkeypatch.setattr(distribute, "export_image", lambda name, store: exported.append(name) or True)
+    monkeypatch.setattr(distribute, "get_local_image_size", lambda name: 100)
+
+    # peer 不可用时只从镜像仓库拉取, 不触发转存; 只有作为 peer 提供服务时才导出
+    image_args = ImageArgs(source="ubuntu:20.04")
+    assert distribute.pull_with_peers(fake_manager, image_args, ["127.0.0.1:1"], LayerStore(str(tmp_path)), serve=serve)
+    assert fake_manager.dispatched == []
+    assert fake_manager.pulled == ["ubuntu:20.04"]
+    assert fake_manager.tagged == [("ubuntu:20.04", "ubuntu:20.04")]
+    assert exported == (["registry.local/ns/ubuntu:20.04"] if serve else [])
+
+
+def test_pull_with_peers_fallback_failed(tmp_path, fake_manager, monkeypatch):
+    # docker pull 的退出码没有被检查, 拉取后本地不存在镜像时视为失败
+    monkeypatch.setattr(distribute, "get_local_image_size", lambda name: None)
+    image_args = ImageArgs(source="ubuntu:20.04")
+    assert not distribute.pull_with_peers(fake_manager, image_args, [], LayerStore(str(tmp_path)))
+    assert fake_manager.pulled == ["ubuntu:20.04"]
+    assert fake_manager.tagged == []
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from dock_worker import app as app_module
+from dock_worker.core import config
+from dock_worker.core.db import JobDurationStats
+from dock_worker.eta import duration_stats, estimate_duration, record_duration, with_eta
+from dock_worker.schemas import JobInDB
+
+WORKFLOW = "eta-test-workflow"
+MB = 1024 ** 2
+
+
+def test_estimate_duration(db):
+    for seconds in [100, 200, 300]:
+        record_duration(WORKFLOW, "ubuntu:20.04", 300 * MB, seconds)
+    record_duration(WORKFLOW, "ubuntu:22.04", 5000 * MB, 1000)
+    record_duration(WORKFLOW, "redis:7", None, 60)
+
+    stats = db.query(JobDurationStats).filter(JobDurationStats.workflow_name == WORKFLOW).all()
+    assert len(stats) == 3
+    ubuntu_small = next(s for s in stats if s.count == 3)
+    assert ubuntu_small.mean == pytest.approx(200)
+    assert ubuntu_small.m2 / (ubuntu_small.count - 1) == pytest.approx(10000)  # 样本方差
+
+    # 精确分组
+    assert estimate_duration(WORKFLOW, "library/ubuntu:latest", 260 * MB) == pytest.approx(200)
+    # 同仓库不同大小, 按次数加权
+    assert estimate_duration(WORKFLOW, "ubuntu:24.04", 100 * 1024 * MB) == pytest.approx(400)
+    # 新仓库, 同大小档位
+    assert estimate_duration(WORKFLOW, "nginx:1", 5000 * MB) == pytest.approx(1000)
+    assert estimate_duration("other-workflow", "nginx:1", None) is None
+
+    now = datetime.now()
+    job_info = JobInDB(
+        id=1, source="ubuntu:20.04", workflow_name=WORKFLOW, image_size=300 * MB, status="in_progress",
+        created_at=now - timedelta(seconds=150), updated_at=now, dispatched_at=now - timedelta(seconds=50),
+    )
+    job_info = with_eta(job_info, now=now)
+    assert (job_info.expected_duration, job_info.eta_seconds) == (pytest.approx(200), pytest.approx(150))
+    assert job_info.duration_stddev == pytest.approx(100)
+
+    # 合并多个分组时按总体计算标准差: 100, 200, 300, 1000
+    mean, stddev = duration_stats(WORKFLOW, "ubuntu:24.04", 100 * 1024 * MB)
+    assert (mean, stddev) == (pytest.approx(400), pytest.approx(408.25, abs=0.01))
+    assert duration_stats(WORKFLOW, "redis:7", None) == (pytest.approx(60), None)
+
+
+def test_api_eta(db, fake_manager, monkeypatch):
+    # 单 worker 模式: /trigger 触发后 run 立即完成, 完成时间为触发后 120 秒
+    fake_manager.run_duration = 120
+    monkeypatch.setattr(config, "multi_worker", False)
+    monkeypatch.setattr(config, "poll_interval", 0.05)
+    request = {"source": "ubuntu:20.04", "workflow": WORKFLOW}
+
+    with TestClient(app_module.app) as client:
+        job = client.post("/trigger", json=request).json()
+        assert (job["expected_duration"], job["eta_seconds"]) == (None, None)
+
+        # 后台 JobTracker 轮询到完成, 写入状态与耗时
+        job = client.get(f"/workflow/runs/{job['distinct_id']}", params={"timeout": 5}).json()
+        assert job["status"] == "completed"
+        assert (job["expected_duration"], job["eta_seconds"]) == (pytest.approx(120, abs=5), 0)
+
+        job = client.post("/trigger", json=request).json()
+        assert job["expected_duration"] == pytest.approx(120, abs=5)
+        assert 0 < job["eta_seconds"] <= job["expected_duration"]
+        assert client.get(f"/jobs/{job['distinct_id']}").json()["expected_duration"] == job["expected_duration"]
+        assert client.get("/jobs").json()[0]["expected_duration"] == job["expected_duration"]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from dock_worker.core.db import Jobs, get_db, init_db
+from dock_worker.core.lease import claim_job_lease, release_job_lease
+from dock_worker.eta import job_duration
+from dock_worker.schemas import JobInDB
+from dock_worker.tracker import JobTracker
+
+
+def test_job_lease(db):
+    job = Jobs(source="source", target="target", status="pending")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+
+    assert claim_job_lease(job_id, owner="worker-1")
+    assert claim_job_lease(job_id, owner="worker-1")  # 续约
+    assert not claim_job_lease(job_id, owner="worker-2")
+
+    # 持有者失联, 租约过期后由其他 worker 接管
+    assert claim_job_lease(job_id, owner="worker-1", ttl=-1)
+    assert claim_job_lease(job_id, owner="worker-2")
+    assert not release_job_lease(job_id, owner="worker-1")
+    assert release_job_lease(job_id, owner="worker-2")
+
+
+def test_legacy_jobs_not_redispatched(db_engine, fake_manager):
+    # 旧版本的表结构, 任务停留在第一次查询到的状态
+    created_at = datetime(2024, 1, 1, 8, 0, 0)
+    with db_engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE jobs (id INTEGER PRIMARY KEY, created_at DATETIME, updated_at DATETIME, source VARCHAR, "
+            "target VARCHAR, run_number INTEGER, run_id VARCHAR, distinct_id VARCHAR, status VARCHAR, "
+            "repo_url VARCHAR, repo_namespace VARCHAR, workflow_id INTEGER, workflow_name VARCHAR, full_url VARCHAR)"
+        ))
+        conn.execute(text(
+            "INSERT INTO jobs (created_at, updated_at, source, target, run_id, distinct_id, status, workflow_id, "
+            "workflow_name) VALUES (:created_at, :created_at, 'ubuntu:20.04', 'ubuntu:20.04', '1', 'legacy', "
+            "'queued', 1, 'ApiDockerImagePusher')"
+        ), {"created_at": created_at})
+    init_db()
+
+    finished_at = created_at + timedelta(minutes=10)
+    fake_manager.add_run("legacy", updated_at=finished_at.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"))
+    JobTracker(owner="worker-1").tick()
+
+    assert fake_manager.dispatched == []
+    with get_db() as session:
+        job = session.query(Jobs).filter(Jobs.distinct_id == "legacy").one()
+        assert (job.status, job.dispatched_at, job.finished_at) == ("completed", created_at, finished_at)
+        assert job_duration(job) == 600
+        assert JobInDB.model_validate(job).attempt == 1
+
+
+def test_lost_lease_discards_result(db, fake_manager):
+    job = Jobs(source="ubuntu:20.04", target="ubuntu:20.04", distinct_id="stolen", status="pending",
+               workflow_id=1, workflow_name="ApiDockerImagePusher")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+
+    def steal_lease(image_args):
+        # 触发请求期间租约过期, 被其他 worker 接管
+        claim_job_lease(job_id, owner="worker-1", ttl=-1)
+        assert claim_job_lease(job_id, owner="worker-2")
+
+    fake_manager.on_fork = steal_lease
+    JobTracker(owner="worker-1").tick()
+
+    db.expire_all()
+    job = db.get(Jobs, job_id)
+    assert (job.status, job.dispatched_at, job.lease_owner) == ("pending", None, "worker-2")
+
+
+def test_waiting_run_stays_active(db, fake_manager):
+    fake_manager.run_status = "waiting"
+    job = Jobs(source="ubuntu:20.04", target="ubuntu:20.04", distinct_id="waiting", status="pending",
+               workflow_id=1, workflow_name="ApiDockerImagePusher", dispatched_at=datetime.now())
+    db.add(job)
+    db.commit()
+    fake_manager.add_run("waiting")
+
+    tracker = JobTracker(owner="worker-1")
+    tracker.tick()
+    db.expire_all()
+    assert db.get(Jobs, job.id).status == "queued"
+    assert tracker.claimable_job_ids() == [job.id]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from dock_worker import app as app_module
+from dock_worker.core import config
+
+LAYER = b"layer-content"
+LAYER_DIGEST = "sha256:layer"
+
+
+def publish_image(registry):
+    """
+    模拟转存: 触发时把镜像写入私有仓库替身, 由 JobTracker 轮询到 run 完成后才视为已转存
+    """
+
+    def on_fork(image_args):
+        repository, _, tag = image_args.target.partition(":")
+        manifest = {
+            "mediaType": "application/vnd.oci.image.manifest.v1+json",
+            "layers": [{"digest": LAYER_DIGEST, "size": len(LAYER)}],
+        }
+        registry.blobs[(f"ns/{repository}", LAYER_DIGEST)] = LAYER
+        registry.add_manifest(f"ns/{repository}", tag, manifest)
+
+    return on_fork
+
+
+@pytest.fixture
+def mirror_env(db, fake_registry, monkeypatch):
+    monkeypatch.setattr(config, "image_repositories_endpoint", fake_registry.address)
+    monkeypatch.setattr(config, "name_space", "ns")
+    monkeypatch.setattr(config, "poll_interval", 0.05)
+    monkeypatch.setattr(config, "mirror_hold_timeout", 2)
+    monkeypatch.setattr(config, "multi_worker", False)
+    monkeypatch.setattr(config, "default_workflow_name", "ApiSkopeoImageCopier")
+
+
+def test_pull_through(mirror_env, fake_registry, fake_manager):
+    fake_manager.on_fork = publish_image(fake_registry)
+
+    with TestClient(app_module.app, follow_redirects=False) as client:
+        assert client.get("/v2/").status_code == 200
+
+        response = client.get("/v2/mirror-test/ubuntu/manifests/20.04")
+        assert response.status_code == 307
+        location = response.headers["location"]
+        assert location == f"http://{fake_registry.address}/v2/ns/mirror-test_ubuntu/manifests/20.04"
+        assert fake_manager.forked == ["mirror-test/ubuntu:20.04"]
+        manifest = requests.get(location).json()
+        assert manifest["layers"][0]["digest"] == LAYER_DIGEST
+
+        response = client.get(f"/v2/mirror-test/ubuntu/blobs/{LAYER_DIGEST}")
+        assert response.status_code == 307
+        assert requests.get(response.headers["location"]).content == LAYER
+
+        # 已转存的镜像直接重定向, 不再触发
+        assert client.head("/v2/mirror-test/ubuntu/manifests/20.04").status_code == 307
+        assert fake_manager.forked == ["mirror-test/ubuntu:20.04"]
+
+
+def test_pull_through_same_basename(mirror_env, fake_registry, fake_manager):
+    fake_manager.on_fork = publish_image(fake_registry)
+    # 私有仓库中已有同名 tag, 但不是由转存任务写入的
+    fake_registry.add_manifest("ns/app", "1", {"mediaType": "application/vnd.oci.image.manifest.v1+json"})
+
+    with TestClient(app_module.app, follow_redirects=False) as client:
+        for name in ["foo/app", "bar/app", "app"]:
+            response = client.get(f"/v2/{name}/manifests/1")
+            assert response.status_code == 307
+            assert response.headers["location"].endswith(f"/v2/ns/{name.replace('/', '_')}/manifests/1")
+    assert fake_manager.forked == ["foo/app:1", "bar/app:1", "app:1"]
+
+
+def test_pull_through_not_ready(mirror_env, fake_manager, monkeypatch):
+    fake_manager.run_status = "in_progress"
+    monkeypatch.setattr(config, "mirror_hold_timeout", 0.2)
+    client = TestClient(app_module.app, follow_redirects=False)
+
+    for _ in range(2):
+        response = client.get("/v2/mirror-test/redis/manifests/7")
+        assert response.status_code == 503
+        assert response.headers["retry-after"]
+        assert response.json()["errors"][0]["code"] == "UNAVAILABLE"
+    # 重试时复用进行中的任务
+    assert fake_manager.forked == ["mirror-test/redis:7"]
+
+
+def test_pull_through_failed(mirror_env, fake_manager):
+    fake_manager.conclusion = "failure"
+    fake_manager.log = "manifest unknown"
+
+    # lifespan 中的 JobTracker 把失败的 run 写回数据库
+    with TestClient(app_module.app, follow_redirects=False) as client:
+        for _ in range(2):
+            response = client.get("/v2/mirror-test/missing/manifests/1")
+            assert response.status_code == 404
+            assert response.json()["errors"][0]["code"] == "MANIFEST_UNKNOWN"
+    # 失败的任务不再被复用, 再次拉取时重新触发
+    assert fake_manager.forked == ["mirror-test/missing:1", "mirror-test/missing:1"]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from dock_worker import app as app_module
+from dock_worker import prefetch
+from dock_worker.core.db import CachedImages, Jobs
+
+
+def test_prefetch_and_evict(db, fake_manager, monkeypatch):
+    removed = []
+    monkeypatch.setattr(prefetch, "get_local_image_size", lambda name: 600)
+    monkeypatch.setattr(prefetch, "get_images_in_use", lambda: {"prefetch-test/busy:1"})
+    monkeypatch.setattr(prefetch, "execute_command", removed.append)
+
+    jobs = [
+        Jobs(source="prefetch-test/old:1", target="old:1", status="completed"),
+        Jobs(source="prefetch-test/busy:1", target="busy:1", status="completed"),
+        Jobs(source="prefetch-test/new:1", target="new:1", status="completed"),
+        Jobs(source="prefetch-test/running:1", target="running:1", status="in_progress"),
+        Jobs(source="prefetch-test/new:1", target="new:1", status="completed"),
+        Jobs(source="other/skip:1", target="skip:1", status="completed"),
+    ]
+    db.add_all(jobs)
+    db.commit()
+
+    daemon = prefetch.PrefetchDaemon(fake_manager, patterns=["prefetch-test/*"], disk_budget=1000, interval=1)
+    for job in daemon.pending_jobs():
+        daemon.prefetch(job)
+    assert fake_manager.pulled == ["old:1", "busy:1", "new:1"]
+    assert daemon.pending_jobs() == []
+
+    # busy 最久未使用但仍被容器引用, 依次淘汰 old, new 直到不超过预算
+    db.expire_all()
+    cached = {image.local_name: image for image in db.query(CachedImages).all()}
+    cached["prefetch-test/old:1"].last_used_at = datetime.now() - timedelta(days=2)
+    cached["prefetch-test/busy:1"].last_used_at = datetime.now() - timedelta(days=3)
+    cached["prefetch-test/new:1"].last_used_at = datetime.now() - timedelta(days=1)
+    db.commit()
+
+    daemon.evict()
+    assert removed == [
+        "docker rmi prefetch-test/old:1 registry.local/ns/old:1",
+        "docker rmi prefetch-test/new:1 registry.local/ns/new:1",
+    ]
+    db.expire_all()
+    cached = db.query(CachedImages).filter(CachedImages.evicted_at.is_(None)).all()
+    assert [image.local_name for image in cached] == ["prefetch-test/busy:1"]
+    # 已淘汰的镜像不会再次拉取
+    assert daemon.pending_jobs() == []
+
+
+def test_prefetch_within_budget(db, fake_manager, monkeypatch):
+    removed = []
+    monkeypatch.setattr(prefetch, "get_local_image_size", lambda name: 400)
+    monkeypatch.setattr(prefetch, "get_images_in_use", lambda: set())
+    monkeypatch.setattr(prefetch, "execute_command", removed.append)
+
+    db.add_all([
+        Jobs(source=f"prefetch-test/{name}:1", target=f"{name}:1", status="completed", image_size=300)
+        for name in ["a", "b", "c"]
+    ])
+    db.commit()
+
+    # 第三个镜像的预估大小超出预算, 停止拉取
+    daemon = prefetch.PrefetchDaemon(fake_manager, patterns=["prefetch-test/*"], disk_budget=1000, interval=1)
+    daemon.tick()
+    assert fake_manager.pulled == ["a:1", "b:1"]
+    assert removed == []
+
+    # 实际大小超出预算时淘汰最久未使用的镜像, 之后的扫描继续拉取, 但不会再次拉取已淘汰的镜像
+    image = db.query(CachedImages).filter(CachedImages.local_name == "prefetch-test/a:1").one()
+    image.size = 900
+    db.commit()
+    daemon.tick()
+    assert removed == ["docker rmi prefetch-test/a:1 registry.local/ns/a:1"]
+    daemon.tick()
+    daemon.tick()
+    assert fake_manager.pulled == ["a:1", "b:1", "c:1"]
+    assert removed == ["docker rmi prefetch-test/a:1 registry.local/ns/a:1"]
+
+
+def test_prefetch_from_api(db, fake_manager, monkeypatch):
+    db.add_all([
+        Jobs(source="prefetch-test/done:1", target="done:1", status="completed", distinct_id="done"),
+        Jobs(source="prefetch-test/running:1", target="running:1", status="in_progress", distinct_id="running"),
+    ])
+    db.commit()
+
+    # 部署主机通过 API 查询任务状态, 请求转发到 TestClient
+    client = TestClient(app_module.app)
+    requested = []
+
+    def fake_get(url, params=None, timeout=None):
+        requested.append(url)
+        return client.get(url.removeprefix("http://api.local:8000"), params=params)
+
+    monkeypatch.setattr(prefetch.requests, "get", fake_get)
+    daemon = prefetch.PrefetchDaemon(fake_manager, patterns=["prefetch-test/*"], api_url="http://api.local:8000/")
+    assert [job.distinct_id for job in daemon.pending_jobs()] == ["done"]
+    assert requested == ["http://api.local:8000/jobs"]
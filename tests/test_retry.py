@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from datetime import datetime, timedelta
+
+from dock_worker.core.db import Jobs
+from dock_worker.retry import FailureKind, RetryPolicy, classify_failure
+from dock_worker.tracker import JobTracker, cancel_superseded_jobs
+
+
+def test_classify_failure(fake_manager):
+    fake_manager.log = "toomanyrequests: rate limit"
+    assert classify_failure(fake_manager, {"id": 1}) == FailureKind.transient
+    fake_manager.log = "manifest unknown"
+    assert classify_failure(fake_manager, {"id": 1}) == FailureKind.permanent
+    assert classify_failure(fake_manager, {"id": 1, "conclusion": "cancelled"}) == FailureKind.cancelled
+
+
+def test_retry_until_max_attempts(db, fake_manager):
+    fake_manager.log = "Error response from daemon: toomanyrequests"
+    run = fake_manager.add_run("a", status="completed", conclusion="failure")
+    tracker = JobTracker(owner="retry-test", retry_policy=RetryPolicy(max_attempts=2, backoff_base=0))
+
+    job = Jobs(source="retry-test/a:1", target="a:1", status="in_progress", run_id=run["id"], attempt=1,
+               dispatched_at=datetime.now())
+    db.add(job)
+    db.commit()
+
+    tracker.poll_job(job)
+    assert job.status == "queued" and job.next_retry_at
+    tracker.poll_job(job)
+    assert fake_manager.reruns == ["1"] and job.attempt == 2 and job.next_retry_at is None
+
+    run.update(status="completed", conclusion="failure")
+    tracker.poll_job(job)
+    assert job.status == "failed"
+    assert fake_manager.reruns == ["1"]
+
+
+def test_cancel_superseded_jobs(db, fake_manager):
+    running = fake_manager.add_run("old", status="in_progress", conclusion=None)
+    succeeded = fake_manager.add_run("finished", status="completed", conclusion="success")
+    now = datetime.now()
+
+    def make_job(distinct_id, status, run_id=None, created_at=now, dispatched=True):
+        return Jobs(source="retry-test/b:1", target="b:1", repo_namespace="ns", status=status, run_id=run_id,
+                    distinct_id=distinct_id, created_at=created_at, dispatched_at=created_at if dispatched else None)
+
+    jobs = [
+        make_job("old", "in_progress", run_id=running["id"]),
+        make_job("done", "completed", run_id=100),
+        # 数据库中尚未轮询到, 但 github 上已经成功的 run
+        make_job("finished", "in_progress", run_id=succeeded["id"]),
+        make_job("stale", "queued", run_id=101, created_at=now - timedelta(days=2)),
+        make_job("undispatched", "pending", dispatched=False),
+        # 已触发, github 上还查不到对应的 run
+        make_job("unlisted", "pending"),
+    ]
+    db.add_all(jobs)
+    db.commit()
+    new_job = make_job("new", "pending", dispatched=False)
+    db.add(new_job)
+    db.commit()
+
+    assert cancel_superseded_jobs(new_job) == ["old", "finished", "undispatched", "unlisted"]
+    # github run 由持有租约的 JobTracker 取消
+    assert fake_manager.cancelled == []
+    db.expire_all()
+    assert [job.status for job in jobs] == ["in_progress", "completed", "in_progress", "queued", "cancelled", "pending"]
+
+    tracker = JobTracker(owner="retry-test")
+    tracker.tick()
+    assert fake_manager.cancelled == ["1"]
+    db.expire_all()
+    assert [job.status for job in jobs] == ["cancelled", "completed", "completed", "queued", "cancelled", "pending"]
+
+    # run 出现后再取消
+    unlisted = fake_manager.add_run("unlisted", status="queued", conclusion=None)
+    tracker.tick()
+    assert fake_manager.cancelled == ["1", str(unlisted["id"])]
+    db.expire_all()
+    assert [job.status for job in jobs] == ["cancelled", "completed", "completed", "queued", "cancelled", "cancelled"]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from fastapi.testclient import TestClient
+
+from dock_worker import app as app_module
+from dock_worker.core import config
+from dock_worker.routing import choose_workflow
+from dock_worker.schemas import DOCKER_WORKFLOW_NAME, SKOPEO_WORKFLOW_NAME
+
+GB = 1024 ** 3
+
+
+def image_manifest(*layer_sizes):
+    return {
+        "mediaType": "application/vnd.oci.image.manifest.v1+json",
+        "layers": [{"digest": f"sha256:{i}", "size": size} for i, size in enumerate(layer_sizes)],
+    }
+
+
+def add_multi_arch_image(registry, repository, reference, sizes: dict[str, list[int]]):
+    manifests = []
+    for platform, layer_sizes in sizes.items():
+        os, arch = platform.split("/")
+        digest = registry.add_manifest(repository, f"{arch}-only", image_manifest(*layer_sizes))
+        manifests.append({"digest": digest, "platform": {"os": os, "architecture": arch}})
+    manifests.append({"digest": "sha256:attestation", "platform": {"os": "unknown", "architecture": "unknown"}})
+    registry.add_manifest(repository, reference, {
+        "mediaType": "application/vnd.oci.image.index.v1+json",
+        "manifests": manifests,
+    })
+
+
+def test_choose_workflow(fake_registry, monkeypatch):
+    monkeypatch.setattr(config, "auto_route_size_threshold", "10G")
+    add_multi_arch_image(fake_registry, "foo/small", "1.0", {
+        "linux/amd64": [GB, GB],
+        "linux/arm64": [GB],
+    })
+    fake_registry.add_manifest("foo/huge", "1.0", image_manifest(8 * GB, 4 * GB))
+
+    decision = choose_workflow(f"{fake_registry.address}/foo/small:1.0")
+    assert decision.workflow_name == SKOPEO_WORKFLOW_NAME
+    assert (decision.image_size, decision.platform_count, decision.platform) == (3 * GB, 2, None)
+
+    decision = choose_workflow(f"{fake_registry.address}/foo/small:1.0", platform="linux/arm64")
+    assert decision.workflow_name == SKOPEO_WORKFLOW_NAME
+    assert (decision.image_size, decision.platform) == (GB, "linux/arm64")
+
+    decision = choose_workflow(f"{fake_registry.address}/foo/huge:1.0")
+    assert decision.workflow_name == DOCKER_WORKFLOW_NAME
+    assert decision.image_size == 12 * GB
+
+    decision = choose_workflow(f"{fake_registry.address}/foo/missing:1.0")
+    assert decision.workflow_name == DOCKER_WORKFLOW_NAME
+    assert decision.image_size is None
+
+    # 无法读取清单时保留指定的平台
+    decision = choose_workflow(f"{fake_registry.address}/foo/missing:1.0", platform="linux/arm64")
+    assert (decision.workflow_name, decision.platform) == (SKOPEO_WORKFLOW_NAME, "linux/arm64")
+
+
+def test_platform_requires_skopeo_workflow(db, fake_manager, monkeypatch):
+    monkeypatch.setattr(config, "multi_worker", False)
+    monkeypatch.setattr(config, "cancel_superseded_runs", False)
+    client = TestClient(app_module.app)
+
+    response = client.post("/trigger", json={
+        "source": "ubuntu:20.04", "workflow": DOCKER_WORKFLOW_NAME, "platform": "linux/arm64",
+    })
+    assert response.status_code == 400
+    assert fake_manager.dispatched == []
+
+    response = client.post("/trigger", json={
+        "source": "ubuntu:20.04", "workflow": SKOPEO_WORKFLOW_NAME, "platform": "linux/arm64",
+    })
+    assert response.status_code == 200
+    assert (response.json()["workflow_name"], response.json()["platform"]) == (SKOPEO_WORKFLOW_NAME, "linux/arm64")
+    assert [image_args.platform for image_args in fake_manager.dispatched] == ["linux/arm64"]